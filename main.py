@@ -1,28 +1,58 @@
 
-from sqlalchemy.orm import Session
-from fastapi import FastAPI, Depends, HTTPException, status, Request
-import jwt
-from dotenv import load_dotenv
-from datetime import datetime, timedelta
-from typing import List
-from werkzeug.security import generate_password_hash, check_password_hash
-import jwt
-from dotenv import load_dotenv
-from typing import Callable
-from functools import wraps
+import asyncio
+import bisect
+import contextvars
+import csv
+import hashlib
+import io
+import json
 import logging
-from sqlalchemy.sql.expression import func
-from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import math
 import os
-from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column, Integer, String, DECIMAL, DateTime, ForeignKey, TEXT, JSON
-from sqlalchemy.sql import func
-from pydantic import BaseModel, EmailStr
-from datetime import datetime
-from typing import Optional
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from enum import Enum
+from functools import wraps
+from typing import Callable, List, Optional
+
+import jwt
+from dotenv import load_dotenv
+from fastapi import FastAPI, Depends, HTTPException, status, Request, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
+from pydantic import BaseModel, EmailStr, ValidationError
+from sqlalchemy import create_engine, insert, select, update, bindparam, case, text, event
+from sqlalchemy import Column, Integer, String, DECIMAL, DateTime, ForeignKey, TEXT, JSON, Index
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.sql import func
+from werkzeug.security import generate_password_hash, check_password_hash
+
+try:
+    import numpy
+except ImportError:
+    # in requirements.txt, without it the adaptive selection tables are built in pure python (~7x slower)
+    numpy = None
+
+try:
+    import orjson
+except ImportError:
+    # in requirements.txt, FastJSONResponse falls back to the stdlib json without it
+    orjson = None
+
+
+load_dotenv()
 
 
 
@@ -69,6 +99,36 @@ class DisplayAnswerInput(BaseModel):
     answer: str
     id : int
 
+class QuestionOut(BaseModel):
+    category: str
+    question: str
+    options: dict
+    success: bool
+    id: int
+
+class AnswerOut(BaseModel):
+    correct: bool
+    message: str
+    amount_earned: Optional[int] = None
+    total_balance: Optional[float] = None
+    correct_answer: Optional[str] = None
+
+class UserStatsOut(BaseModel):
+    success: bool
+    total_attempted: int
+    correct_count: int
+    wrong_count: int
+    accuracy_percentage: float
+    total_earnings: float
+
+class SelectionMode(str, Enum):
+    random = "random"
+    adaptive = "adaptive"
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
 
 
 
@@ -95,6 +155,9 @@ class Users(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
+    # serves the status filter and the id keyset of the users list
+    __table_args__ = (Index("ix_users_status_id", "status", "id"),)
+
 class UserWallet(Base):
     __tablename__ = "user_wallet"
 
@@ -103,12 +166,16 @@ class UserWallet(Base):
     amount = Column(DECIMAL(10, 2), default=0.00, nullable=False)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (Index("ix_user_wallet_user_id_timestamp", "user_id", "timestamp"),)
+
 class QuizData(Base):
     __tablename__ = "quiz_data"
 
     id = Column(Integer, autoincrement=True, primary_key=True, nullable=False)
-    category = Column(String(100), nullable=False)
-    question = Column(TEXT, unique=True, nullable=False)
+    category = Column(String(100), nullable=False, index=True)
+    question = Column(TEXT, nullable=False)
+    # sha256 of the normalized question text, see question_hash()
+    question_hash = Column(String(64), unique=True, index=True, nullable=True)
     options = Column(JSON, nullable=False)
     answer = Column(TEXT, nullable=False)
     views = Column(Integer, default=0, nullable=False)
@@ -117,6 +184,12 @@ class QuizData(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
+class QuizCategory(Base):
+    __tablename__ = "quiz_categories"
+
+    name = Column(String(100), primary_key=True, nullable=False)
+    question_count = Column(Integer, default=0, nullable=False)
+
 class UserQuizes(Base):
     __tablename__ = "user_quizes"
 
@@ -126,10 +199,20 @@ class UserQuizes(Base):
     status = Column(Integer, nullable=False)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
 
+    # one attempt per user and question, also the lookup index of the answer path,
+    # rows are appended in time order so a BRIN index serves time range scans for a few pages
+    __table_args__ = (Index("ux_user_quizes_user_id_quiz_id", "user_id", "quiz_id", unique=True),
+                      Index("brin_user_quizes_timestamp", "timestamp", postgresql_using="brin"))
 
+class UserStats(Base):
+    __tablename__ = "user_stats"
 
+    user_id = Column(Integer, ForeignKey(Users.id), primary_key=True, nullable=False)
+    total_attempted = Column(Integer, default=0, nullable=False)
+    correct_count = Column(Integer, default=0, nullable=False)
+    wrong_count = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
-load_dotenv()
 
 
 
@@ -140,21 +223,256 @@ user = os.getenv("USER_NAME", "")
 host = os.getenv("HOST", "")
 port = os.getenv("PORT", "")
 database = os.getenv("DATABASE", "")
-DATABASE_URL = f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{database}"
 
+def async_database_url(url: str) -> str:
+    """ the asyncpg / aiosqlite flavour of a sync database url"""
+    for sync_prefix, async_prefix in (("postgresql+psycopg2://", "postgresql+asyncpg://"),
+                                      ("postgresql://", "postgresql+asyncpg://"),
+                                      ("sqlite://", "sqlite+aiosqlite://")):
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
+
+
+# DATABASE_URL overrides the url built from the variables above
+DATABASE_URL = os.getenv("DATABASE_URL") or f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{database}"
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_database_url(DATABASE_URL)
+
+# read replica for the read-only endpoints, same user/password/database as the primary,
+# REPLICA_DATABASE_URL overrides the url, without either the primary serves every read
+replica_host = os.getenv("REPLICA_HOST", "")
+replica_port = os.getenv("REPLICA_PORT", "") or port
+REPLICA_DATABASE_URL = os.getenv("REPLICA_DATABASE_URL") or (
+    f"postgresql+psycopg2://{user}:{password}@{replica_host}:{replica_port}/{database}" if replica_host else "")
+REPLICA_ASYNC_DATABASE_URL = os.getenv("REPLICA_ASYNC_DATABASE_URL") or async_database_url(REPLICA_DATABASE_URL)
+# seconds after a user's write during which their reads stay on the primary
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))   # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))   # seconds, -1 keeps connections forever
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# PgBouncer in transaction mode hands each transaction to any server connection,
+# so asyncpg must not keep prepared statements across transactions
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+
+
+class PoolWaitStats:
+    """ records how long checkouts wait for a connection and how many time out"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._wait_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            with self._wait_lock:
+                self.timeouts += 1
+            raise
+        waited = time.perf_counter() - start
+        with self._wait_lock:
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        return connection
+
+    def wait_stats(self):
+        with self._wait_lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_avg": round(self.wait_seconds_total / self.checkouts, 6) if self.checkouts else 0.0,
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+            }
+
+
+class TimedQueuePool(PoolWaitStats, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(PoolWaitStats, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_options():
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def pool_stats(pool):
+    """ checked out / overflow counts and checkout wait time of an engine's pool"""
+    stats = {"pool": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, name, None)
+        if callable(method):
+            stats[name] = method()
+    if isinstance(pool, PoolWaitStats):
+        stats.update(pool.wait_stats())
+    return stats
 
-engine = create_engine(DATABASE_URL)
 
-SessionLocal = sessionmaker(autoflush=False, autocommit = False, bind=engine)
+class Engines:
+    """
+    sync and async engines with their session factories, created on first use
+    or by the app's lifespan, so importing main needs no reachable database
+    """
+
+    def __init__(self, url: str = DATABASE_URL, async_url: str = ASYNC_DATABASE_URL):
+        self.url = url
+        self.async_url = async_url
+        self._engine = None
+        self._async_engine = None
+        self._sessions = None
+        self._async_sessions = None
+        self._lock = threading.Lock()
+
+    def _connect_args(self, url: str) -> dict:
+        if url.startswith("sqlite"):
+            return {"check_same_thread": False} if "aiosqlite" not in url else {}
+        if DB_PGBOUNCER and "asyncpg" in url:
+            # unique names keep statements prepared on one server connection from clashing with another's
+            return {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+            }
+        return {}
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            with self._lock:
+                if self._engine is None:
+                    engine = create_engine(self.url, poolclass=TimedQueuePool,
+                                           connect_args=self._connect_args(self.url), **pool_options())
+                    instrument_engine(engine)
+                    self._sessions = sessionmaker(autoflush=False, autocommit = False, bind=engine)
+                    self._engine = engine
+        return self._engine
+
+    @property
+    def async_engine(self):
+        # async handlers use this engine so a slow query doesn't block the event loop
+        if self._async_engine is None:
+            with self._lock:
+                if self._async_engine is None:
+                    async_engine = create_async_engine(self.async_url, poolclass=TimedAsyncQueuePool,
+                                                       connect_args=self._connect_args(self.async_url), **pool_options())
+                    instrument_engine(async_engine.sync_engine)
+                    self._async_sessions = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=async_engine)
+                    self._async_engine = async_engine
+        return self._async_engine
+
+    def session(self) -> Session:
+        self.engine
+        return self._sessions()
+
+    def async_session(self) -> AsyncSession:
+        self.async_engine
+        return self._async_sessions()
+
+    def connect(self):
+        """ build both engines, connections are still only opened by the first query"""
+        self.engine
+        self.async_engine
+
+    async def dispose(self):
+        with self._lock:
+            engine, async_engine = self._engine, self._async_engine
+            self._engine = self._async_engine = None
+        if async_engine is not None:
+            await async_engine.dispose()
+        if engine is not None:
+            engine.dispose()
+
+
+engines = Engines()
 
 def get_db():
-    db = SessionLocal()
+    db = engines.session()
     try:
         yield db
     finally:
         db.close()
 
 
+async def get_async_db():
+    async with engines.async_session() as db:
+        yield db
+
+
+replica_engines = Engines(REPLICA_DATABASE_URL, REPLICA_ASYNC_DATABASE_URL) if REPLICA_DATABASE_URL else None
+
+
+class RecentWrites:
+    """
+    users who wrote within the last window_seconds, kept in write order so expired
+    entries are dropped from the front, their reads go to the primary so a replica
+    that lags behind never hides their own writes (per worker process)
+    """
+
+    def __init__(self, window_seconds: float = READ_YOUR_WRITES_SECONDS):
+        self.window_seconds = window_seconds
+        self._until = OrderedDict()
+        self._lock = threading.Lock()
+
+    def mark(self, user_id: int):
+        now = time.monotonic()
+        with self._lock:
+            self._until[user_id] = now + self.window_seconds
+            self._until.move_to_end(user_id)
+            while self._until and next(iter(self._until.values())) <= now:
+                self._until.popitem(last=False)
+
+    def active(self, user_id: int) -> bool:
+        until = self._until.get(user_id)
+        return until is not None and time.monotonic() < until
+
+    def clear(self):
+        with self._lock:
+            self._until.clear()
+
+
+recent_writes = RecentWrites()
+
+
+def read_engines(request: Request) -> Engines:
+    """ the replica, unless none is configured or the caller wrote within READ_YOUR_WRITES_SECONDS"""
+    if replica_engines is None:
+        return engines
+    user_id = optional_user_id(request)
+    if user_id is not None and recent_writes.active(user_id):
+        return engines
+    return replica_engines
+
+
+def get_read_db(request: Request):
+    db = read_engines(request).session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db(request: Request):
+    async with read_engines(request).async_session() as db:
+        yield db
+
+
 
 # ------------------- LOGS ------------------------
 
@@ -169,11 +487,148 @@ logger = logging.getLogger(__name__)
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRY_MINUTES = 30  #min
 
+SECRET_KEY = os.getenv("SECRET_KEY")
+
+# werkzeug method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000"
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+# hashes allowed to wait for a worker before /user and /login answer 503
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "32"))
+
+# verified tokens kept in memory, entries are dropped at the token expiry
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+# rows per duplicate check and INSERT of the bulk import, and rows per request
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "100000"))
+
+# rows fetched per round trip by the export endpoints
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+USERS_PAGE_SIZE = 50
+USERS_MAX_PAGE_SIZE = 500
+
+# render the hot endpoints with FastJSONResponse instead of jsonable_encoder + json
+FAST_JSON = os.getenv("FAST_JSON", "false").lower() == "true"
+
+# keep a user_stats row per user up to date on every answer
+USER_STATS_MATERIALIZED = os.getenv("USER_STATS_MATERIALIZED", "false").lower() == "true"
+
 
 
 
 # ------------------- UTILS -------------------------
 
+def fast_json_default(value):
+    """ orjson hook, a Decimal is written as its exact digits instead of going through float"""
+    if isinstance(value, Decimal):
+        return orjson.Fragment(str(value))
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def stdlib_json_default(value):
+    if isinstance(value, Decimal):
+        # the stdlib can't write raw digits, integral amounts stay exact as int, others go
+        # through float (exact digits need orjson 3.9+), as jsonable_encoder does
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered by orjson, or by the stdlib json without it or with an orjson
+    older than 3.9 (no Fragment to write Decimal digits), with no jsonable_encoder pass
+    """
+
+    def render(self, content) -> bytes:
+        if orjson is not None and hasattr(orjson, "Fragment"):
+            return orjson.dumps(content, default=fast_json_default)
+        return json.dumps(content, default=stdlib_json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def fast_response(content, response: Optional[Response] = None):
+    """
+    with FAST_JSON the content is rendered right away by FastJSONResponse, skipping
+    jsonable_encoder and the response model, otherwise FastAPI serializes it as usual,
+    headers set on the injected response are carried over
+    """
+    if not FAST_JSON:
+        return content
+    headers = None
+    if response is not None:
+        headers = {key: value for key, value in response.headers.items() if key != "content-length"}
+    return FastJSONResponse(content, headers=headers)
+
+
+class TokenCache:
+    """ bounded LRU of verified token -> user id, an entry is dropped at the token exp"""
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[int]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            user_id, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return user_id
+
+    def put(self, token: str, user_id: int, expires_at: float):
+        with self._lock:
+            self._entries[token] = (user_id, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+
+def verify_token(token: str) -> int:
+    """ user id of a valid token, checked against the cache before decoding"""
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        return user_id
+
+    try:
+        if not SECRET_KEY:
+            raise ValueError("SECRET KEY must be set in environment variables")
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        user_id = payload.get("sub")
+        if user_id is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail = "User id is not found in the token payload",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        user_id = int(user_id)
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+    # tokens without exp never expire, so they are not cached
+    if "exp" in payload:
+        token_cache.put(token, user_id, float(payload["exp"]))
+    return user_id
+
+
 def token_required(func: Callable):
     @wraps(func)
     async def wrapper(request: Request, *args, **kwargs):
@@ -181,76 +636,1502 @@ def token_required(func: Callable):
         if not auth_header or not auth_header.startswith("Bearer "):
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token is missing",
                                  headers={"WWW-Authenticate": "Bearer"},)
-        
-        logger.info(f"Auth Header: {auth_header}")
 
         token = auth_header.split(" ")[1]
-        logger.info(f"Token: {token}")
+        kwargs["current_user_id"] = verify_token(token)
+        result = await func(request, *args, **kwargs)
+        if request.method not in ("GET", "HEAD") and replica_engines is not None and recent_writes.window_seconds > 0:
+            # keep this user's reads on the primary until the replica caught up
+            recent_writes.mark(kwargs["current_user_id"])
+        return result
+    return wrapper
 
-        try:
-            SECRET_KEY = os.getenv("SECRET_KEY")
-            if not SECRET_KEY:
-                raise ValueError("SECRET KEY must be set in environment variables")
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            logger.info(f"Payload: {payload}")
-            user_id = payload.get("sub")
-            if user_id is None:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail = "User id is not found in the token payload",
-                    headers={"WWW-Authenticate": "Bearer"},
-                )
 
-        except Exception as e:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Could not validate credentials",
-                headers={"WWW-Authenticate": "Bearer"}
-            )
-        new_user_id = int(user_id)
-        kwargs["current_user_id"] = new_user_id
-        return await func(request, *args, **kwargs)
-    return wrapper
+def optional_user_id(request: Request) -> Optional[int]:
+    """ user id when a valid bearer token is sent, None for anonymous requests and stale tokens"""
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return None
+    try:
+        return verify_token(auth_header.split(" ")[1])
+    except HTTPException:
+        # the endpoints using this are public, an expired or invalid token reads as anonymous
+        return None
 
 
 
     
 
 
-def generate_password(password: str) -> str:
+class PasswordHasher:
+    """
+    runs the password KDFs on a dedicated, size limited thread pool (hashlib
+    releases the GIL while hashing), callers beyond the queue limit get a 503
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, queue_limit: int = PASSWORD_HASH_QUEUE_LIMIT,
+                 method: str = PASSWORD_HASH_METHOD):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.method = method
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._stats = {"completed": 0, "rejected": 0,
+                       "kdf_seconds_total": 0.0, "kdf_seconds_max": 0.0,
+                       "queue_wait_seconds_total": 0.0, "queue_wait_seconds_max": 0.0}
+
+    async def _run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.workers + self.queue_limit:
+                self._stats["rejected"] += 1
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    detail="Server is busy, try again later", headers={"Retry-After": "1"})
+            self._pending += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+            executor = self._executor
+
+        submitted_at = time.perf_counter()
+
+        def job():
+            started_at = time.perf_counter()
+            result = fn(*args)
+            return result, started_at - submitted_at, time.perf_counter() - started_at
+
+        try:
+            result, queue_wait, kdf_time = await asyncio.wrap_future(executor.submit(job))
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+        with self._lock:
+            self._stats["completed"] += 1
+            self._stats["kdf_seconds_total"] += kdf_time
+            self._stats["kdf_seconds_max"] = max(self._stats["kdf_seconds_max"], kdf_time)
+            self._stats["queue_wait_seconds_total"] += queue_wait
+            self._stats["queue_wait_seconds_max"] = max(self._stats["queue_wait_seconds_max"], queue_wait)
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run(generate_password_hash, password, self.method)
+
+    async def verify(self, hashed_password: str, plain_password: str) -> bool:
+        return await self._run(check_password_hash, hashed_password, plain_password)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, in_flight=self._pending, workers=self.workers, queue_limit=self.queue_limit)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+password_hasher = PasswordHasher()
+
+
+async def generate_password(password: str) -> str:
+
+    return await password_hasher.hash(password)
+
+async def verify_password(hashed_password: str, plain_password: str) -> bool:
+
+    return await password_hasher.verify(hashed_password, plain_password)
+
+
+
+def dialect_insert(db, model):
+    """ INSERT statement with ON CONFLICT support for the database behind the session"""
+    if db.bind.dialect.name == "sqlite":
+        return sqlite_insert(model)
+    return postgresql_insert(model)
+
+
+def category_count_upsert(db, added: dict):
+    """ add question counts per category to quiz_categories"""
+    statement = dialect_insert(db, QuizCategory).values(
+        [{"name": name, "question_count": count} for name, count in sorted(added.items())])
+    return statement.on_conflict_do_update(
+        index_elements=[QuizCategory.name],
+        set_={"question_count": QuizCategory.question_count + statement.excluded.question_count})
+
+
+def user_stats_query(user_id: int):
+    """ attempt counts and balance of a user aggregated in one query"""
+    return (select(func.count(UserQuizes.id),
+                   func.coalesce(func.sum(case((UserQuizes.status == 1, 1), else_=0)), 0),
+                   func.coalesce(func.sum(case((UserQuizes.status == 0, 1), else_=0)), 0),
+                   Users.total_amount)
+            .select_from(Users)
+            .outerjoin(UserQuizes, UserQuizes.user_id == Users.id)
+            .filter(Users.id == user_id)
+            .group_by(Users.id, Users.total_amount))
+
+
+def materialized_user_stats_query(user_id: int):
+    """ same columns as user_stats_query read from the user_stats row"""
+    return (select(UserStats.total_attempted, UserStats.correct_count, UserStats.wrong_count, Users.total_amount)
+            .join(Users, Users.id == UserStats.user_id)
+            .filter(UserStats.user_id == user_id))
+
+
+def user_stats_upsert(db, user_id: int, correct_count: int, wrong_count: int):
+    """
+    add attempts to the user_stats row, the first insert counts the
+    existing history so the table doesn't need a backfill
+    """
+    history = (select(UserQuizes.user_id,
+                      func.count(UserQuizes.id),
+                      func.coalesce(func.sum(case((UserQuizes.status == 1, 1), else_=0)), 0),
+                      func.coalesce(func.sum(case((UserQuizes.status == 0, 1), else_=0)), 0))
+               .filter(UserQuizes.user_id == user_id)
+               .group_by(UserQuizes.user_id))
+    statement = dialect_insert(db, UserStats).from_select(
+        ["user_id", "total_attempted", "correct_count", "wrong_count"], history)
+    return statement.on_conflict_do_update(
+        index_elements=[UserStats.user_id],
+        set_={"total_attempted": UserStats.total_attempted + correct_count + wrong_count,
+              "correct_count": UserStats.correct_count + correct_count,
+              "wrong_count": UserStats.wrong_count + wrong_count,
+              "updated_at": func.now()})
+
+
+def normalize_question(question: str) -> str:
+    """ question text with whitespace collapsed and case folded"""
+    return " ".join(question.split()).casefold()
 
-    return generate_password_hash(password)
 
-def verify_password(hashed_password: str, plain_password: str) -> bool:
+def question_hash(question: str) -> str:
+    """ content hash used to detect duplicate questions"""
+    return hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
 
-    return check_password_hash(hashed_password, plain_password)
 
+async def require_admin(db: AsyncSession, user_id: int):
+    """ raise 403 unless the user has the admin role"""
+    user_role = await db.scalar(select(Users.user_role).filter(Users.id == user_id))
+    if user_role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
 
 
-def get_user_by_email(db: Session, email: str):
+async def get_user_by_email(db: AsyncSession, email: str):
     """ retrive user by the email id"""
-    db_user = db.query(Users).filter(Users.email == email).first()
+    db_user = await db.scalar(select(Users).filter(Users.email == email))
     return db_user
 
 
-def create_user_db(db: Session, user: UserCreate):
+async def create_user_db(db: AsyncSession, user: UserCreate):
     """
     create new user with name, email, password
     """
+    hashed_password = await generate_password(user.password)
     try:
-        hashed_password = generate_password(user.password)
         db_user = Users(name = user.name, email = user.email, password = hashed_password)
         db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        await db.commit()
+        await db.refresh(db_user)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Transaction failed")
     
     return db_user
 
 
-app = FastAPI()
+
+# ------------------- QUESTION INDEX -------------------------
+
+QUESTION_INDEX_TTL_SECONDS = float(os.getenv("QUESTION_INDEX_TTL_SECONDS", "300"))
+UNSEEN_PICK_DRAWS = 64
+
+
+class QuestionIndex:
+    """
+    in-process index of question ids per category, so a random question is
+    one O(1) pick plus a primary key lookup instead of ORDER BY random()
+    """
+
+    def __init__(self, ttl_seconds: float = QUESTION_INDEX_TTL_SECONDS):
+        # categories are reloaded after ttl_seconds so rows added by other workers show up
+        self.ttl_seconds = ttl_seconds
+        self._ids = {}
+        self._positions = {}
+        self._loaded_at = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def load(self, db: Session, category: str):
+        """ read all ids of the category from the database"""
+        ids = [row[0] for row in db.query(QuizData.id).filter(QuizData.category == category).all()]
+        with self._lock:
+            self._ids[category] = ids
+            self._positions[category] = {question_id: position for position, question_id in enumerate(ids)}
+            self._loaded_at[category] = time.monotonic()
+
+    def is_loaded(self, category: str) -> bool:
+        loaded_at = self._loaded_at.get(category)
+        return loaded_at is not None and time.monotonic() - loaded_at < self.ttl_seconds
+
+    def ensure_loaded(self, db: Session, category: str):
+        """
+        one request per category reloads an expired category, the others keep picking
+        from the old ids meanwhile and only wait when the category was never loaded
+        """
+        if self.is_loaded(category):
+            return
+        with self._lock:
+            load_lock = self._load_locks.setdefault(category, threading.Lock())
+            stale = category in self._ids
+        if not load_lock.acquire(blocking=not stale):
+            return
+        try:
+            if not self.is_loaded(category):
+                self.load(db, category)
+        finally:
+            load_lock.release()
+
+    def add(self, category: str, question_id: int):
+        """ register a newly inserted question, categories not loaded yet pick it up on load"""
+        with self._lock:
+            positions = self._positions.get(category)
+            if positions is None or question_id in positions:
+                return
+            positions[question_id] = len(self._ids[category])
+            self._ids[category].append(question_id)
+
+    def discard(self, category: str, question_id: int):
+        """ remove an id in O(1) by swapping it with the last one"""
+        with self._lock:
+            positions = self._positions.get(category)
+            if positions is None or question_id not in positions:
+                return
+            ids = self._ids[category]
+            position = positions.pop(question_id)
+            last_id = ids.pop()
+            if last_id != question_id:
+                ids[position] = last_id
+                positions[last_id] = position
+
+    def random_id(self, category: str) -> Optional[int]:
+        with self._lock:
+            ids = self._ids.get(category)
+            return random.choice(ids) if ids else None
+
+    def pick(self, db: Session, category: str) -> Optional[QuizData]:
+        """ return a uniformly random question of the category or None"""
+        self.ensure_loaded(db, category)
+
+        while True:
+            question_id = self.random_id(category)
+            if question_id is None:
+                return None
+            question = db.get(QuizData, question_id)
+            if question is not None and question.category == category:
+                return question
+            question = self.recheck(db, category, question_id)
+            if question is not None:
+                return question
+
+    def recheck(self, db: Session, category: str, question_id: int) -> Optional[QuizData]:
+        """
+        a question the session didn't find, a lagging replica may not have it yet so it
+        is read from the primary, the id only leaves the index when that misses too
+        """
+        question = None
+        if replica_engines is not None and db.get_bind() is replica_engines.engine:
+            with engines.session() as primary:
+                question = primary.get(QuizData, question_id)
+        if question is not None and question.category == category:
+            return question
+        # row was deleted or changed outside of the api
+        self.discard(category, question_id)
+        return None
+
+    def sample_ids(self, category: str, count: int, exclude=frozenset(), taken=frozenset()) -> List[int]:
+        """
+        up to count distinct random ids in neither exclude nor taken (anything with `in`,
+        like an AttemptBitmap), a sample of twice count usually has enough of them, users
+        who attempted most of the category get theirs from one pass over the ids
+        """
+        def wanted(question_id):
+            return question_id not in exclude and question_id not in taken
+
+        with self._lock:
+            ids = self._ids.get(category) or []
+            drawn = random.sample(ids, min(len(ids), 2 * count))
+            sampled = [question_id for question_id in drawn if wanted(question_id)][:count]
+            if len(sampled) < count and len(drawn) < len(ids):
+                remaining = [question_id for question_id in ids if wanted(question_id)]
+                sampled = random.sample(remaining, min(count, len(remaining)))
+        return sampled
+
+    def pick_many(self, db: Session, category: str, count: int, exclude=frozenset()) -> List[QuizData]:
+        """ count distinct random questions of the category not in exclude with one IN query"""
+        self.ensure_loaded(db, category)
+
+        taken = set()
+        questions = []
+        while len(questions) < count:
+            ids = self.sample_ids(category, count - len(questions), exclude, taken)
+            if not ids:
+                break
+            found = {question.id: question for question in db.query(QuizData).filter(QuizData.id.in_(ids)).all()}
+            for question_id in ids:
+                question = found.get(question_id)
+                if question is None or question.category != category:
+                    question = self.recheck(db, category, question_id)
+                if question is not None:
+                    questions.append(question)
+                taken.add(question_id)
+        return questions
+
+    def random_unseen_id(self, category: str, seen) -> Optional[int]:
+        """
+        random id not in seen, random draws cover users who have seen most of the
+        category (with 90% seen 64 draws all miss once in ~850 calls), after that the
+        ids are walked from a random position to the next unseen one
+        """
+        with self._lock:
+            ids = self._ids.get(category)
+            if not ids:
+                return None
+            for _ in range(UNSEEN_PICK_DRAWS):
+                question_id = random.choice(ids)
+                if question_id not in seen:
+                    return question_id
+            start = random.randrange(len(ids))
+            for position in range(start - len(ids), start):
+                if ids[position] not in seen:
+                    return ids[position]
+        return None
+
+    def pick_unseen(self, db: Session, category: str, seen) -> Optional[QuizData]:
+        """ random question of the category whose id is not in seen, None when all were seen"""
+        self.ensure_loaded(db, category)
+
+        while True:
+            question_id = self.random_unseen_id(category, seen)
+            if question_id is None:
+                return None
+            question = db.get(QuizData, question_id)
+            if question is not None and question.category == category:
+                return question
+            question = self.recheck(db, category, question_id)
+            if question is not None:
+                return question
+
+    def has_questions(self, category: str) -> bool:
+        with self._lock:
+            return bool(self._ids.get(category))
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._positions.clear()
+            self._loaded_at.clear()
+
+
+question_index = QuestionIndex()
+
+
+
+# ------------------- ATTEMPTED QUESTIONS -------------------------
+
+ATTEMPTED_CACHE_SIZE = int(os.getenv("ATTEMPTED_CACHE_SIZE", "10000"))   # users
+ATTEMPTED_CACHE_TTL_SECONDS = float(os.getenv("ATTEMPTED_CACHE_TTL_SECONDS", "300"))
+
+
+# rough size of one id in a python set (the int and its slot), a user's ids switch
+# to a bitmap once one bit per id between the lowest and highest one takes less
+ATTEMPT_SET_BYTES_PER_ID = 32
+
+
+class AttemptBitmap:
+    """
+    set of quiz ids, a plain set while the ids are sparse and one bit per id from the
+    lowest to the highest once that is smaller: 100k attempts spread over 200k ids
+    take 25 KB, a single attempt on id 1,000,000 takes one set entry
+    """
+
+    __slots__ = ("ids", "bits", "base", "low", "high", "count")
+
+    def __init__(self, quiz_ids=()):
+        self.ids = set()
+        self.bits = None
+        self.base = 0
+        self.low = self.high = None
+        self.count = 0
+        for quiz_id in quiz_ids:
+            self.add(quiz_id)
+
+    def _span_bytes(self, low: int, high: int) -> int:
+        return ((high - low) >> 3) + 1
+
+    def _to_bits(self):
+        self.base = self.low & ~7
+        self.bits = bytearray(((self.high - self.base) >> 3) + 1)
+        for quiz_id in self.ids:
+            offset = quiz_id - self.base
+            self.bits[offset >> 3] |= 1 << (offset & 7)
+        self.ids = set()
+
+    def _to_set(self):
+        self.ids = set(self)
+        self.bits = None
+
+    def _fit(self, quiz_id: int):
+        """ grow the bitmap geometrically to cover quiz_id so ascending or descending ids don't copy every time"""
+        if quiz_id < self.base:
+            base = max(min(quiz_id & ~7, self.base - len(self.bits) * 8), 0)
+            self.bits[:0] = bytes((self.base - base) >> 3)
+            self.base = base
+        byte = (quiz_id - self.base) >> 3
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(max(byte + 1, len(self.bits) * 2) - len(self.bits)))
+
+    def add(self, quiz_id: int):
+        if quiz_id in self:
+            return
+        self.count += 1
+        self.low = quiz_id if self.low is None else min(self.low, quiz_id)
+        self.high = quiz_id if self.high is None else max(self.high, quiz_id)
+        dense = self._span_bytes(self.low, self.high) <= self.count * ATTEMPT_SET_BYTES_PER_ID
+        if self.bits is not None and not dense:
+            self._to_set()
+        if self.bits is None:
+            self.ids.add(quiz_id)
+            if dense:
+                self._to_bits()
+            return
+        self._fit(quiz_id)
+        offset = quiz_id - self.base
+        self.bits[offset >> 3] |= 1 << (offset & 7)
+
+    def __contains__(self, quiz_id: int) -> bool:
+        if self.bits is None:
+            return quiz_id in self.ids
+        offset = quiz_id - self.base
+        return 0 <= offset and (offset >> 3) < len(self.bits) and bool(self.bits[offset >> 3] & (1 << (offset & 7)))
+
+    def __iter__(self):
+        if self.bits is None:
+            yield from self.ids
+            return
+        for byte, value in enumerate(self.bits):
+            if value:
+                for bit in range(8):
+                    if value & (1 << bit):
+                        yield self.base + (byte << 3) + bit
+
+    def __len__(self):
+        return self.count
+
+
+class AttemptedQuestions:
+    """
+    LRU cache of the quiz ids each user attempted, loaded with one query over the
+    (user_id, quiz_id) index, so picking an unseen question needs no NOT IN
+    (SELECT quiz_id FROM user_quizes ...) per call
+    """
+
+    def __init__(self, max_users: int = ATTEMPTED_CACHE_SIZE, ttl_seconds: float = ATTEMPTED_CACHE_TTL_SECONDS):
+        # reloaded after ttl_seconds so answers taken by other workers show up
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, db: Session, user_id: int) -> AttemptBitmap:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl_seconds:
+                self._entries.move_to_end(user_id)
+                return entry[0]
+
+        quiz_ids = db.scalars(select(UserQuizes.quiz_id).filter(UserQuizes.user_id == user_id)).all()
+        bitmap = AttemptBitmap(quiz_ids)
+        with self._lock:
+            self._entries[user_id] = (bitmap, time.monotonic())
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        return bitmap
+
+    def add(self, user_id: int, quiz_id: int):
+        """ record an attempt, users not cached pick it up on load"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                entry[0].add(quiz_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+attempted_questions = AttemptedQuestions()
+
+
+
+# ------------------- QUESTION CACHE -------------------------
+
+QUESTION_CACHE_SIZE = int(os.getenv("QUESTION_CACHE_SIZE", "100000"))
+# redis://host:6379/0 shares loaded answers between workers, needs the redis package
+QUESTION_CACHE_URL = os.getenv("QUESTION_CACHE_URL", "")
+
+
+class RedisQuestionStore:
+    """ shared question id -> (answer, category) store"""
+
+    def __init__(self, url: str, prefix: str = "quiz:question:"):
+        import redis.asyncio as redis
+        self.client = redis.from_url(url)
+        self.prefix = prefix
+
+    async def get(self, question_id: int):
+        value = await self.client.get(f"{self.prefix}{question_id}")
+        return tuple(json.loads(value)) if value is not None else None
+
+    async def set(self, question_id: int, entry):
+        await self.client.set(f"{self.prefix}{question_id}", json.dumps(entry))
+
+    async def delete(self, question_id: int):
+        await self.client.delete(f"{self.prefix}{question_id}")
+
+
+class QuestionCache:
+    """
+    read-through LRU of question id -> (answer, category) for the answer path,
+    questions don't change after they are added so entries only leave the cache
+    when it is full or on invalidate()
+    """
+
+    def __init__(self, max_size: int = QUESTION_CACHE_SIZE, shared=None):
+        self.max_size = max_size
+        self.shared = shared
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, question_id: int):
+        with self._lock:
+            entry = self._entries.get(question_id)
+            if entry is not None:
+                self._entries.move_to_end(question_id)
+            return entry
+
+    def put(self, question_id: int, answer: str, category: str):
+        with self._lock:
+            self._entries[question_id] = (answer, category)
+            self._entries.move_to_end(question_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    async def get(self, db: AsyncSession, question_id: int):
+        """ (answer, category) from memory, the shared store or the database, None for unknown ids"""
+        entry = self.lookup(question_id)
+        if entry is not None:
+            return entry
+
+        if self.shared is not None:
+            try:
+                entry = await self.shared.get(question_id)
+            except Exception as e:
+                logger.warning(f"shared question cache read failed: {e}")
+            if entry is not None:
+                self.put(question_id, *entry)
+                return entry
+
+        row = (await db.execute(select(QuizData.answer, QuizData.category).filter(QuizData.id == question_id))).first()
+        if row is None:
+            return None
+        entry = (row.answer, row.category)
+        self.put(question_id, *entry)
+        if self.shared is not None:
+            try:
+                await self.shared.set(question_id, entry)
+            except Exception as e:
+                logger.warning(f"shared question cache write failed: {e}")
+        return entry
+
+    async def get_many(self, db: AsyncSession, question_ids) -> dict:
+        """ question id -> (answer, category) of the known ids, misses are read with one IN query"""
+        found = {}
+        for question_id in question_ids:
+            entry = self.lookup(question_id)
+            if entry is None and self.shared is not None:
+                try:
+                    entry = await self.shared.get(question_id)
+                except Exception as e:
+                    logger.warning(f"shared question cache read failed: {e}")
+                if entry is not None:
+                    self.put(question_id, *entry)
+            if entry is not None:
+                found[question_id] = entry
+
+        missing = [question_id for question_id in question_ids if question_id not in found]
+        if missing:
+            rows = (await db.execute(select(QuizData.id, QuizData.answer, QuizData.category)
+                                     .filter(QuizData.id.in_(missing)))).all()
+            for question_id, answer, category in rows:
+                found[question_id] = (answer, category)
+                self.put(question_id, answer, category)
+        return found
+
+    async def invalidate(self, question_id: int):
+        """ drop a changed or deleted question, other workers keep their local copy until evicted"""
+        with self._lock:
+            self._entries.pop(question_id, None)
+        if self.shared is not None:
+            try:
+                await self.shared.delete(question_id)
+            except Exception as e:
+                logger.warning(f"shared question cache delete failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+question_cache = QuestionCache(shared=RedisQuestionStore(QUESTION_CACHE_URL) if QUESTION_CACHE_URL else None)
+
+
+
+# ------------------- LEADERBOARD -------------------------
+
+LEADERBOARD_TTL_SECONDS = float(os.getenv("LEADERBOARD_TTL_SECONDS", "300"))
+LEADERBOARD_MAX_LIMIT = 100
+
+
+class RankedScores:
+    """
+    users ordered by score, highest first and ties by user id, kept as sorted
+    buckets of (-score, user_id) with a Fenwick tree over the bucket sizes, so
+    set, remove and rank are O(log n) plus a short memmove inside one bucket
+    """
+
+    BUCKET_SIZE = 512
+
+    def __init__(self, scores: Optional[dict] = None):
+        self.build(scores or {})
+
+    def build(self, scores: dict):
+        self._scores = dict(scores)
+        keys = sorted((-score, user_id) for user_id, score in self._scores.items())
+        self._buckets = [keys[start:start + self.BUCKET_SIZE] for start in range(0, len(keys), self.BUCKET_SIZE)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._rebuild_tree()
+
+    def _rebuild_tree(self):
+        tree = [0] * (len(self._buckets) + 1)
+        for position in range(1, len(tree)):
+            tree[position] += len(self._buckets[position - 1])
+            parent = position + (position & -position)
+            if parent < len(tree):
+                tree[parent] += tree[position]
+        self._tree = tree
+
+    def _add_to_tree(self, bucket_index: int, delta: int):
+        position = bucket_index + 1
+        while position < len(self._tree):
+            self._tree[position] += delta
+            position += position & -position
+
+    def _count_before(self, bucket_index: int) -> int:
+        total, position = 0, bucket_index
+        while position > 0:
+            total += self._tree[position]
+            position -= position & -position
+        return total
+
+    def _insert(self, key):
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            self._rebuild_tree()
+            return
+        index = min(bisect.bisect_left(self._maxes, key), len(self._buckets) - 1)
+        bucket = self._buckets[index]
+        bisect.insort(bucket, key)
+        self._maxes[index] = bucket[-1]
+        if len(bucket) > 2 * self.BUCKET_SIZE:
+            half = len(bucket) // 2
+            self._buckets[index:index + 1] = [bucket[:half], bucket[half:]]
+            self._maxes[index:index + 1] = [bucket[half - 1], bucket[-1]]
+            self._rebuild_tree()
+        else:
+            self._add_to_tree(index, 1)
+
+    def _remove(self, key):
+        index = bisect.bisect_left(self._maxes, key)
+        bucket = self._buckets[index]
+        del bucket[bisect.bisect_left(bucket, key)]
+        if bucket:
+            self._maxes[index] = bucket[-1]
+            self._add_to_tree(index, -1)
+        else:
+            del self._buckets[index]
+            del self._maxes[index]
+            self._rebuild_tree()
+
+    def set(self, user_id: int, score):
+        old = self._scores.get(user_id)
+        if old is not None:
+            if old == score:
+                return
+            self._remove((-old, user_id))
+        self._scores[user_id] = score
+        self._insert((-score, user_id))
+
+    def remove(self, user_id: int):
+        old = self._scores.pop(user_id, None)
+        if old is not None:
+            self._remove((-old, user_id))
+
+    def score(self, user_id: int):
+        return self._scores.get(user_id)
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """ 1 based position of the user, None if the user has no score"""
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        key = (-score, user_id)
+        index = bisect.bisect_left(self._maxes, key)
+        return self._count_before(index) + bisect.bisect_left(self._buckets[index], key) + 1
+
+    def top(self, count: int):
+        """ (user_id, score) of the first count users"""
+        result = []
+        for bucket in self._buckets:
+            for negative_score, user_id in bucket[:count - len(result)]:
+                result.append((user_id, -negative_score))
+            if len(result) >= count:
+                break
+        return result
+
+    def __len__(self):
+        return len(self._scores)
+
+
+class Leaderboard:
+    """
+    global ranking of active users by users.total_amount and per category ranking
+    by the amount earned with correct answers in the category, rebuilt from the
+    database at startup and every ttl_seconds by a background task (answers taken
+    by other workers), updated in place by this worker's answers and user changes
+    """
+
+    def __init__(self, session_factory, ttl_seconds: float = LEADERBOARD_TTL_SECONDS):
+        self.session_factory = session_factory
+        self.ttl_seconds = ttl_seconds
+        self._global = RankedScores()
+        self._categories = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        # one first load at a time, concurrent requests wait for it instead of running their own
+        self._load_lock = threading.Lock()
+        self._task = None
+
+    def load(self):
+        with self.session_factory() as db:
+            totals = dict(db.execute(select(Users.id, Users.total_amount).filter(Users.status == "active")).all())
+            earned = db.execute(select(UserQuizes.user_id, QuizData.category, func.count(UserQuizes.id))
+                                .join(QuizData, QuizData.id == UserQuizes.quiz_id)
+                                .filter(UserQuizes.status == 1)
+                                .group_by(UserQuizes.user_id, QuizData.category)).all()
+
+        per_category = {}
+        for user_id, category, correct_count in earned:
+            if user_id in totals:
+                per_category.setdefault(category, {})[user_id] = correct_count * ANSWER_REWARD
+        categories = {category: RankedScores(scores) for category, scores in per_category.items()}
+        ranking = RankedScores(totals)
+        with self._lock:
+            self._global, self._categories = ranking, categories
+            self._loaded_at = time.monotonic()
+
+    def ensure_loaded(self):
+        """ first load when startup couldn't reach the database, later rebuilds are the background task's"""
+        if self._loaded_at is not None:
+            return
+        with self._load_lock:
+            if self._loaded_at is None:
+                self.load()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.ttl_seconds)
+            try:
+                await asyncio.to_thread(self.load)
+            except Exception as e:
+                logger.error(f"Leaderboard rebuild failed: {e}")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def credit(self, user_id: int, category: Optional[str], total_amount):
+        """ a correct answer, total_amount is the new balance returned by the answer path"""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            if total_amount is not None:
+                self._global.set(user_id, Decimal(total_amount))
+            if category is not None:
+                ranking = self._categories.setdefault(category, RankedScores())
+                ranking.set(user_id, (ranking.score(user_id) or 0) + ANSWER_REWARD)
+
+    def update_user(self, user_id: int, user_status: str, total_amount):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            if user_status != "active":
+                self._global.remove(user_id)
+                for ranking in self._categories.values():
+                    ranking.remove(user_id)
+            else:
+                self._global.set(user_id, Decimal(total_amount))
+
+    def board(self, category: Optional[str], limit: int, user_id: Optional[int] = None):
+        """ top (user_id, score) pairs, the ranked user count and the (rank, score) of user_id"""
+        with self._lock:
+            ranking = self._global if category is None else self._categories.get(category, RankedScores())
+            me = None
+            if user_id is not None:
+                me = (ranking.rank(user_id), ranking.score(user_id))
+            return ranking.top(limit), len(ranking), me
+
+    def clear(self):
+        with self._lock:
+            self._global = RankedScores()
+            self._categories = {}
+            self._loaded_at = None
+
+
+leaderboard = Leaderboard(engines.session)
+
+
+
+# ------------------- CATEGORY CACHE -------------------------
+
+CATEGORY_CACHE_TTL_SECONDS = float(os.getenv("CATEGORY_CACHE_TTL_SECONDS", "60"))
+# max-age sent to clients with /categories
+CATEGORY_MAX_AGE_SECONDS = int(os.getenv("CATEGORY_MAX_AGE_SECONDS", "60"))
+
+
+class CategoryCache:
+    """
+    /categories body and its ETag built from quiz_categories, reloaded after ttl_seconds,
+    the first load after an invalidate reads the primary so a lagging replica can't
+    put the old list back for a whole ttl
+    """
+
+    def __init__(self, ttl_seconds: float = CATEGORY_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._snapshot = None
+        self._loaded_at = None
+        self._invalidations = 0
+        self._reload_from_primary = False
+        self._lock = threading.Lock()
+
+    def get(self, db: Session):
+        """ (body, etag) of the category list, body is None when there are no categories"""
+        with self._lock:
+            if self._snapshot is not None and time.monotonic() - self._loaded_at < self.ttl_seconds:
+                return self._snapshot
+            invalidations, from_primary = self._invalidations, self._reload_from_primary
+
+        if from_primary and replica_engines is not None and db.get_bind() is replica_engines.engine:
+            with engines.session() as primary:
+                rows = self._rows(primary)
+        else:
+            rows = self._rows(db)
+        body = None
+        if rows:
+            body = {"categories": [name for name, _ in rows],
+                    "category_count": len(rows),
+                    "question_counts": {name: count for name, count in rows}}
+        etag = '"' + hashlib.sha256(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()[:32] + '"'
+
+        with self._lock:
+            # an invalidate while this was loading makes the rows stale, serve them once but don't keep them
+            if invalidations == self._invalidations:
+                self._snapshot = (body, etag)
+                self._loaded_at = time.monotonic()
+                self._reload_from_primary = False
+        return body, etag
+
+    def _rows(self, db: Session):
+        return db.query(QuizCategory.name, QuizCategory.question_count).filter(
+            QuizCategory.question_count > 0).order_by(QuizCategory.name).all()
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+            self._invalidations += 1
+            self._reload_from_primary = True
+
+    def clear(self):
+        with self._lock:
+            self._snapshot = None
+            self._invalidations += 1
+            self._reload_from_primary = False
+
+
+category_cache = CategoryCache()
+
+
+
+# ------------------- QUESTION COUNTERS -------------------------
+
+COUNTER_FLUSH_INTERVAL_SECONDS = float(os.getenv("COUNTER_FLUSH_INTERVAL_SECONDS", "5"))
+COUNTER_SHARDS = int(os.getenv("COUNTER_SHARDS", "16"))
+
+
+class QuestionCounters:
+    """
+    write-behind buffer for the views/correct/wrong counters of quiz_data,
+    answers only touch an in-memory shard and a background task adds the
+    deltas to the table in one batched UPDATE per flush
+    """
+
+    def __init__(self, session_factory, shards: int = COUNTER_SHARDS,
+                 flush_interval_seconds: float = COUNTER_FLUSH_INTERVAL_SECONDS):
+        self.session_factory = session_factory
+        self.flush_interval_seconds = flush_interval_seconds
+        self._shards = [{} for _ in range(shards)]
+        self._locks = [threading.Lock() for _ in range(shards)]
+        self._task = None
+
+    def record(self, question_id: int, correct: bool):
+        shard = question_id % len(self._shards)
+        with self._locks[shard]:
+            views, correct_count, wrong_count = self._shards[shard].get(question_id, (0, 0, 0))
+            self._shards[shard][question_id] = (views + 1, correct_count + int(correct), wrong_count + int(not correct))
+
+    def _merge(self, deltas: dict):
+        for question_id, (views, correct_count, wrong_count) in deltas.items():
+            shard = question_id % len(self._shards)
+            with self._locks[shard]:
+                old = self._shards[shard].get(question_id, (0, 0, 0))
+                self._shards[shard][question_id] = (old[0] + views, old[1] + correct_count, old[2] + wrong_count)
+
+    def _drain(self) -> dict:
+        deltas = {}
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                deltas.update(shard)
+                shard.clear()
+        return deltas
+
+    async def flush(self) -> int:
+        """ write buffered deltas to quiz_data, returns the number of questions updated"""
+        deltas = self._drain()
+        if not deltas:
+            return 0
+
+        table = QuizData.__table__
+        statement = (update(table)
+                     .where(table.c.id == bindparam("question_id"))
+                     .values(views = table.c.views + bindparam("delta_views"),
+                             correct_guess_count = table.c.correct_guess_count + bindparam("delta_correct"),
+                             wrong_guess_count = table.c.wrong_guess_count + bindparam("delta_wrong")))
+        params = [{"question_id": question_id, "delta_views": views, "delta_correct": correct_count, "delta_wrong": wrong_count}
+                  for question_id, (views, correct_count, wrong_count) in sorted(deltas.items())]
+        try:
+            async with self.session_factory() as db:
+                await db.execute(statement, params)
+                await db.commit()
+        except Exception as e:
+            # keep the deltas for the next flush
+            self._merge(deltas)
+            logger.error(f"Counter flush failed: {e}")
+            return 0
+        return len(params)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval_seconds)
+            await self.flush()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+question_counters = QuestionCounters(engines.async_session)
+
+
+# ------------------- ADAPTIVE SELECTION -------------------------
+
+ADAPTIVE_TARGET_ACCURACY = float(os.getenv("ADAPTIVE_TARGET_ACCURACY", "0.7"))
+ADAPTIVE_BANDS = int(os.getenv("ADAPTIVE_BANDS", "5"))
+ADAPTIVE_REBUILD_SECONDS = float(os.getenv("ADAPTIVE_REBUILD_SECONDS", "30"))
+ADAPTIVE_RELOAD_SECONDS = float(os.getenv("ADAPTIVE_RELOAD_SECONDS", "3600"))
+ADAPTIVE_PICK_DRAWS = 64
+# every question keeps a little weight in every band so none is never shown
+ADAPTIVE_MIN_WEIGHT = 0.01
+
+
+def success_rates(correct, wrong):
+    """ share of correct answers per question with one correct and one wrong guess added, unseen questions are 0.5"""
+    if numpy is not None:
+        return (numpy.asarray(correct, dtype=numpy.float64) + 1) / (numpy.asarray(correct) + numpy.asarray(wrong) + 2)
+    return [(c + 1) / (c + w + 2) for c, w in zip(correct, wrong)]
+
+
+def band_weights(rates, center: float, width: float):
+    """ gaussian weight around the success rate the band serves"""
+    if numpy is not None:
+        return numpy.exp(-0.5 * ((rates - center) / width) ** 2) + ADAPTIVE_MIN_WEIGHT
+    return [math.exp(-0.5 * ((rate - center) / width) ** 2) + ADAPTIVE_MIN_WEIGHT for rate in rates]
+
+
+def build_alias_table(weights):
+    """
+    Walker/Vose alias table for the weights: position i is kept with probability
+    prob[i] and otherwise replaced by alias[i], so a weighted draw is O(1)
+    """
+    if numpy is not None:
+        return _numpy_alias_table(numpy.asarray(weights, dtype=numpy.float64))
+    return _python_alias_table(weights)
+
+
+def _python_alias_table(weights):
+    count = len(weights)
+    total = sum(weights)
+    prob = [weight * count / total for weight in weights]
+    alias = list(range(count))
+    small = [position for position, p in enumerate(prob) if p < 1]
+    large = [position for position, p in enumerate(prob) if p >= 1]
+    while small and large:
+        position = small.pop()
+        alias[position] = large[-1]
+        prob[large[-1]] -= 1 - prob[position]
+        if prob[large[-1]] < 1:
+            small.append(large.pop())
+    # whatever is left is 1 up to rounding
+    for position in small + large:
+        prob[position] = 1.0
+    return prob, alias
+
+
+def _numpy_alias_table(weights):
+    """
+    the pairing of Vose's loop without the loop: the missing mass of the small
+    entries and the excess of the large ones are laid end to end, a small entry
+    takes its alias from the large one its segment starts in, a large entry that
+    gives away more than its excess is topped up from the next large one.
+    both sides use the same comparison (segment start < excess end) so equal
+    cumulative sums can't send a segment to one large entry and its cost to another
+    """
+    count = len(weights)
+    prob = weights * (count / weights.sum())
+    alias = numpy.arange(count)
+    small = numpy.flatnonzero(prob < 1)
+    large = numpy.flatnonzero(prob >= 1)
+    if len(small) and len(large):
+        deficit_ends = numpy.cumsum(1 - prob[small])
+        deficit_starts = numpy.concatenate(([0.0], deficit_ends[:-1]))
+        excess_ends = numpy.cumsum(prob[large] - 1)
+        # the large entry owning a segment is the first whose excess ends after the segment starts
+        owner = numpy.minimum(numpy.searchsorted(excess_ends, deficit_starts, side="right"), len(large) - 1)
+        alias[small] = large[owner]
+        # the segment running over the end of a large entry's excess is the last one starting before it
+        straddling = numpy.maximum(numpy.searchsorted(deficit_starts, excess_ends, side="left") - 1, 0)
+        prob[large] = 1 - numpy.clip(deficit_ends[straddling] - excess_ends, 0, 1)
+        alias[large[:-1]] = large[1:]
+    prob[large[-1:]] = 1.0
+    return numpy.minimum(prob, 1.0), alias
+
+
+def smoothed_accuracy(total_attempted: int, correct_count: int, target: float) -> float:
+    """ user's share of correct answers starting from the target, two answers weigh as much as the prior"""
+    return (correct_count + 2 * target) / (total_attempted + 2)
+
+
+class AdaptiveSelector:
+    """
+    weighted random questions per category: the success rate of every question
+    (correct/wrong guess counters) gives it a weight in each difficulty band and
+    every band has a precomputed alias table, a user is served from the band that
+    should put their accuracy at the target, each draw is O(1) at any category size.
+    answers are recorded in memory and a background task folds them into the
+    counts and rebuilds only the categories they touch
+    """
+
+    def __init__(self, bands: int = ADAPTIVE_BANDS,
+                 rebuild_interval_seconds: float = ADAPTIVE_REBUILD_SECONDS,
+                 reload_seconds: float = ADAPTIVE_RELOAD_SECONDS):
+        # categories are read again after reload_seconds so new or deleted questions show up
+        self.centers = [(band + 0.5) / bands for band in range(bands)]
+        self.width = 0.5 / bands
+        self.rebuild_interval_seconds = rebuild_interval_seconds
+        self.reload_seconds = reload_seconds
+        self._categories = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._task = None
+
+    def build(self, ids, correct, wrong) -> dict:
+        """ tables of every band for the ids, ascending, and their counters"""
+        if numpy is not None:
+            ids, correct, wrong = (numpy.asarray(values, dtype=numpy.int64) for values in (ids, correct, wrong))
+        rates = success_rates(correct, wrong)
+        tables = []
+        if len(ids):
+            for center in self.centers:
+                prob, alias = build_alias_table(band_weights(rates, center, self.width))
+                tables.append((prob, ids[alias] if numpy is not None else [ids[position] for position in alias]))
+        return {"ids": ids, "correct": correct, "wrong": wrong, "tables": tables,
+                "mean": float(numpy.mean(rates) if numpy is not None else sum(rates) / len(rates)) if len(ids) else 0.5,
+                "loaded_at": time.monotonic()}
+
+    def load(self, db: Session, category: str):
+        rows = db.execute(select(QuizData.id, QuizData.correct_guess_count, QuizData.wrong_guess_count)
+                          .filter(QuizData.category == category)
+                          .order_by(QuizData.id)).all()
+        entry = self.build([row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows])
+        with self._lock:
+            self._categories[category] = entry
+
+    def is_loaded(self, category: str) -> bool:
+        entry = self._categories.get(category)
+        return entry is not None and time.monotonic() - entry["loaded_at"] < self.reload_seconds
+
+    def ensure_loaded(self, db: Session, category: str):
+        """ single reload per category like QuestionIndex.ensure_loaded, the old tables serve meanwhile"""
+        if self.is_loaded(category):
+            return
+        with self._lock:
+            load_lock = self._load_locks.setdefault(category, threading.Lock())
+            stale = category in self._categories
+        if not load_lock.acquire(blocking=not stale):
+            return
+        try:
+            if not self.is_loaded(category):
+                self.load(db, category)
+        finally:
+            load_lock.release()
+
+    def record(self, question_id: int, correct: bool):
+        with self._lock:
+            counts = self._pending.setdefault(question_id, [0, 0])
+            counts[0 if correct else 1] += 1
+
+    def _apply(self, entry: dict, pending: dict):
+        """ counters of the entry with the pending answers added, None when none of them is in it"""
+        ids = entry["ids"]
+        if numpy is not None:
+            question_ids = numpy.fromiter(pending, dtype=numpy.int64, count=len(pending))
+            positions = numpy.minimum(numpy.searchsorted(ids, question_ids), len(ids) - 1)
+            found = ids[positions] == question_ids
+            if not found.any():
+                return None
+            deltas = numpy.array([pending[question_id] for question_id in question_ids[found].tolist()], dtype=numpy.int64)
+            correct, wrong = entry["correct"].copy(), entry["wrong"].copy()
+            correct[positions[found]] += deltas[:, 0]
+            wrong[positions[found]] += deltas[:, 1]
+            return correct, wrong
+
+        correct, wrong = None, None
+        for question_id, (correct_delta, wrong_delta) in pending.items():
+            position = bisect.bisect_left(ids, question_id)
+            if position == len(ids) or ids[position] != question_id:
+                continue
+            if correct is None:
+                correct, wrong = list(entry["correct"]), list(entry["wrong"])
+            correct[position] += correct_delta
+            wrong[position] += wrong_delta
+        return None if correct is None else (correct, wrong)
+
+    def rebuild(self) -> int:
+        """ fold the recorded answers into the loaded categories, returns how many were rebuilt"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            categories = list(self._categories.items())
+        if not pending:
+            return 0
+
+        rebuilt = 0
+        for category, entry in categories:
+            if not len(entry["ids"]):
+                continue
+            counters = self._apply(entry, pending)
+            if counters is None:
+                continue
+            updated = self.build(entry["ids"], *counters)
+            updated["loaded_at"] = entry["loaded_at"]
+            with self._lock:
+                # skip categories reloaded from the database in the meantime
+                if self._categories.get(category) is entry:
+                    self._categories[category] = updated
+                    rebuilt += 1
+        return rebuilt
+
+    def band(self, category: str, accuracy: float, target: float) -> int:
+        """
+        a user answering `accuracy` of questions whose mean success rate is `mean`
+        should get about target on questions with success rate target - accuracy + mean
+        """
+        entry = self._categories.get(category)
+        mean = entry["mean"] if entry else 0.5
+        wanted = min(max(target - accuracy + mean, 0.0), 1.0)
+        return min(range(len(self.centers)), key=lambda band: abs(self.centers[band] - wanted))
+
+    def random_id(self, category: str, band: int, seen=frozenset()) -> Optional[int]:
+        """ weighted random id of the band not in seen, None when the draws keep hitting seen ids"""
+        entry = self._categories.get(category)
+        if not entry or not entry["tables"]:
+            return None
+        ids, (prob, alias) = entry["ids"], entry["tables"][band]
+        for _ in range(ADAPTIVE_PICK_DRAWS):
+            position = random.randrange(len(ids))
+            question_id = int(ids[position] if random.random() < prob[position] else alias[position])
+            if question_id not in seen:
+                return question_id
+        return None
+
+    def pick(self, db: Session, category: str, accuracy: float, target: float, seen) -> Optional[QuizData]:
+        """ weighted unseen question of the category, uniform over the unseen ones once the draws run dry"""
+        self.ensure_loaded(db, category)
+        band = self.band(category, accuracy, target)
+        # a few tries for rows deleted since the tables were built
+        for _ in range(3):
+            question_id = self.random_id(category, band, seen)
+            if question_id is None:
+                break
+            question = db.get(QuizData, question_id)
+            if question is not None and question.category == category:
+                return question
+        return question_index.pick_unseen(db, category, seen)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.rebuild_interval_seconds)
+            try:
+                await asyncio.to_thread(self.rebuild)
+            except Exception as e:
+                logger.error(f"Adaptive tables rebuild failed: {e}")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def clear(self):
+        with self._lock:
+            self._categories.clear()
+            self._pending.clear()
+
+
+adaptive_selector = AdaptiveSelector()
+
+
+
+# ------------------- METRICS -------------------------
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """ cumulative bucket counts, sum and count in the prometheus layout"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+        self.sum += value
+        self.count += 1
+
+
+def format_labels(labels):
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metrics:
+    """
+    per route request counts, latency, db time and query count histograms,
+    rendered in the prometheus text format on /metrics
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter()
+        self.latency = {}
+        self.db_time = {}
+        self.queries = {}
+
+    def observe(self, method, route, status_code, seconds, db_seconds, query_count):
+        key = (method, route)
+        with self._lock:
+            self.requests[(method, route, str(status_code))] += 1
+            self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.db_time.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(db_seconds)
+            self.queries.setdefault(key, Histogram(QUERY_COUNT_BUCKETS)).observe(query_count)
+
+    def render(self):
+        lines = ["# HELP http_requests_total Requests by route and status code.",
+                 "# TYPE http_requests_total counter"]
+        with self._lock:
+            for (method, route, status_code), count in sorted(self.requests.items()):
+                labels = format_labels((("method", method), ("route", route), ("status", status_code)))
+                lines.append(f"http_requests_total{labels} {count}")
+            for name, help_text, histograms in (
+                ("http_request_duration_seconds", "Request latency.", self.latency),
+                ("http_request_db_seconds", "Time spent in database queries per request.", self.db_time),
+                ("http_request_db_queries", "Database queries per request.", self.queries),
+            ):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for (method, route), histogram in sorted(histograms.items()):
+                    labels = (("method", method), ("route", route))
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {count}")
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self.requests.clear()
+            self.latency.clear()
+            self.db_time.clear()
+            self.queries.clear()
+
+
+metrics = Metrics()
+
+
+class RequestDatabaseUsage:
+    __slots__ = ("seconds", "queries")
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.queries = 0
+
+
+# set by the middleware, sync handlers in the threadpool and the async engine's greenlets share it
+request_db_usage = contextvars.ContextVar("request_db_usage", default=None)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info["query_start_time"].pop()
+    usage = request_db_usage.get()
+    if usage is not None:
+        usage.seconds += time.perf_counter() - start
+        usage.queries += 1
+
+
+def instrument_engine(sync_engine):
+    """ count queries and time spent in them for the request being served"""
+    if not event.contains(sync_engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(sync_engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", after_cursor_execute)
+
+
+class MetricsMiddleware:
+    """ asgi middleware, the timing includes streamed response bodies"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        usage = RequestDatabaseUsage()
+        token = request_db_usage.set(usage)
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_db_usage.reset(token)
+            # the route template keeps /user/123 and /user/456 in one series
+            route = getattr(scope.get("route"), "path", "unmatched")
+            metrics.observe(scope["method"], route, status_code, time.perf_counter() - start,
+                            usage.seconds, usage.queries)
+
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # tables are created by `python manage.py migrate`, not by the app
+    engines.connect()
+    if replica_engines is not None:
+        replica_engines.connect()
+    question_counters.start()
+    adaptive_selector.start()
+    try:
+        await asyncio.to_thread(leaderboard.load)
+    except Exception as e:
+        # served once the database is reachable, the first /leaderboard call loads it
+        logger.warning(f"leaderboard not loaded at startup: {e}")
+    leaderboard.start()
+    try:
+        yield
+    finally:
+        await question_counters.stop()
+        await adaptive_selector.stop()
+        await leaderboard.stop()
+        password_hasher.shutdown()
+        await engines.dispose()
+        if replica_engines is not None:
+            await replica_engines.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -260,45 +2141,46 @@ app.add_middleware(
     allow_headers = ["*"]
 )
 
-# create database tables based on the models.py
-Base.metadata.create_all(bind=engine)
+app.add_middleware(MetricsMiddleware)
 
 
 #    ------------------------- CREATE USER ----------------------------
 
 @app.post("/user", tags = ["Users"], status_code=status.HTTP_201_CREATED)
-def create_user(user : UserCreate, db: Session = Depends(get_db)):
-    db_user = get_user_by_email(db, user.email)
+async def create_user(user : UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await get_user_by_email(db, user.email)
     if db_user:
         raise HTTPException(status_code=400, detail= "Email already registered")
     
-    db_user = create_user_db(db = db, user = user)
+    db_user = await create_user_db(db = db, user = user)
+    leaderboard.update_user(db_user.id, db_user.status, db_user.total_amount)
 
     return {"status": True, "message": "User created succesfully", "id": db_user.id, "email": db_user.email}
 
 # ----------------------- DELETE USER -------------------------------
 @app.delete("/user", tags = ["Users"], status_code=status.HTTP_200_OK)
 @token_required
-async def delete_user(request: Request, db: Session = Depends(get_db), current_user_id : int = None):
-    user = db.query(Users).filter(Users.id == current_user_id).first()
+async def delete_user(request: Request, db: AsyncSession = Depends(get_async_db), current_user_id : int = None):
+    user = await db.scalar(select(Users).filter(Users.id == current_user_id))
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="user not available")
 
     try:
         user.status = "inactive"
-        db.commit()
+        await db.commit()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Transaction failed")
+    leaderboard.update_user(current_user_id, user.status, user.total_amount)
     return {"detail": "user deleted successfully"}
 
 
 # --------------------------- USER LOGIN -------------------------------------
 
 @app.post("/login", tags = ["Users"], status_code=status.HTTP_200_OK)
-def login(user: UserLogin, db: Session = Depends(get_db)):
+async def login(user: UserLogin, db: AsyncSession = Depends(get_async_db)):
 
-    db_user = db.query(Users).filter(Users.email == user.email).first()
+    db_user = await get_user_by_email(db, user.email)
 
     if not db_user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Invalid credentials")
@@ -309,7 +2191,7 @@ def login(user: UserLogin, db: Session = Depends(get_db)):
     
     
     
-    if not verify_password(db_user.password, user.password):
+    if not await verify_password(db_user.password, user.password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email or password")
 
     payload = {"sub": str(db_user.id)}
@@ -317,8 +2199,6 @@ def login(user: UserLogin, db: Session = Depends(get_db)):
     expire = datetime.utcnow()+ timedelta(minutes=int(ACCESS_TOKEN_EXPIRY_MINUTES))
     payload.update({"exp": expire})
 
-    SECRET_KEY = os.getenv("SECRET_KEY")
-
     if not SECRET_KEY:
         raise ValueError("SECRET KEY must be set in environmental variables")
 
@@ -327,13 +2207,49 @@ def login(user: UserLogin, db: Session = Depends(get_db)):
     return {"status": True, "message": "Login succesfull", "email": db_user.email, "token": token}
 
 
+# --------------------------- INTERNAL -------------------------------------
+
+@app.get("/internal/password_hashing", tags = ["Internal"], include_in_schema=False)
+def password_hashing_stats():
+    """ KDF time and queue wait of the password hashing pool"""
+    return password_hasher.stats()
+
+
+@app.get("/metrics", tags = ["Internal"], include_in_schema=False, response_class=PlainTextResponse)
+def metrics_endpoint():
+    """ request, latency and database metrics in the prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/internal/db_pool", tags = ["Internal"], include_in_schema=False)
+def db_pool_stats():
+    """ connection pool usage of the sync and async engines, and of the replica's"""
+    stats = {"sync": pool_stats(engines.engine.pool), "async": pool_stats(engines.async_engine.pool)}
+    if replica_engines is not None:
+        stats["replica_sync"] = pool_stats(replica_engines.engine.pool)
+        stats["replica_async"] = pool_stats(replica_engines.async_engine.pool)
+    return stats
+
+
 # ------------------------------ USERS LIST ----------------------------------
 
 @app.get("/users", tags = ["Users"],response_model=List[UserList], status_code=status.HTTP_200_OK)
 @token_required
-async def user_list(request: Request, db: Session = Depends(get_db), current_user_id : int = None):
-    users_data = db.query(Users).filter(Users.status == "active").all()
-    return users_data
+async def user_list(request: Request, response: Response,
+                    cursor: int = Query(0, ge=0, description="id of the last user of the previous page"),
+                    limit: int = Query(USERS_PAGE_SIZE, ge=1, le=USERS_MAX_PAGE_SIZE),
+                    db: AsyncSession = Depends(get_async_read_db), current_user_id : int = None):
+    # only the UserList columns, never the password hash
+    users_query = (select(Users.id, Users.name, Users.email, Users.status, Users.total_amount,
+                          Users.created_at, Users.updated_at)
+                   .filter(Users.status == "active", Users.id > cursor)
+                   .order_by(Users.id)
+                   .limit(limit))
+    rows = (await db.execute(users_query)).mappings().all()
+
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = str(rows[-1]["id"])
+    return fast_response([{field: row[field] for field in UserList.model_fields} for row in rows], response)
 
 
 
@@ -341,9 +2257,9 @@ async def user_list(request: Request, db: Session = Depends(get_db), current_use
 
 @app.get("/user", tags = ["Users"], status_code=status.HTTP_200_OK)
 @token_required
-async def get_user_by_id(request: Request, db: Session = Depends(get_db), current_user_id : int = None) :
+async def get_user_by_id(request: Request, db: AsyncSession = Depends(get_async_read_db), current_user_id : int = None) :
 
-    user_data = db.query(Users).filter(Users.id == current_user_id).first()
+    user_data = await db.scalar(select(Users).filter(Users.id == current_user_id))
 
     return {"data": user_data}
 
@@ -352,22 +2268,23 @@ async def get_user_by_id(request: Request, db: Session = Depends(get_db), curren
 
 @app.put("/user", tags = ["Users"], status_code=status.HTTP_200_OK)
 @token_required
-async def update_user(request: Request, userRequest: UpdateUser, db : Session = Depends(get_db), current_user_id : int = None):
+async def update_user(request: Request, userRequest: UpdateUser, db : AsyncSession = Depends(get_async_db), current_user_id : int = None):
     #logger.info(f"current_user_id : {current_user_id}")
-    user_query = db.query(Users).filter(Users.id == current_user_id)
-    user_data = user_query.first()
+    user_data = await db.scalar(select(Users).filter(Users.id == current_user_id))
     #logger.info(f"user_data: {user_data}")
     if not user_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="user not found")
     try:
-        user_query.update(userRequest.dict(), synchronize_session = False)
+        await db.execute(update(Users).filter(Users.id == current_user_id).values(userRequest.dict()),
+                         execution_options={"synchronize_session": False})
         logger.info("query completed")
-        db.commit()
-        db.refresh(user_data)
+        await db.commit()
+        await db.refresh(user_data)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Update failed: {e}")
         raise HTTPException(status_code=500, detail="Transaction failed")
+    leaderboard.update_user(current_user_id, user_data.status, user_data.total_amount)
     
     return user_data
 
@@ -376,182 +2293,731 @@ async def update_user(request: Request, userRequest: UpdateUser, db : Session =
 
 @app.post("/add_question", tags = ["Questions"], status_code=status.HTTP_201_CREATED)
 @token_required
-async def add_question(request: Request, addQuestion: AddQuestion, db: Session = Depends(get_db), current_user_id: int = None):
-    existing_question = db.query(QuizData).filter(QuizData.question == addQuestion.question).first()
+async def add_question(request: Request, addQuestion: AddQuestion, db: AsyncSession = Depends(get_async_db), current_user_id: int = None):
+    content_hash = question_hash(addQuestion.question)
+    existing_question = await db.scalar(select(QuizData.id).filter(QuizData.question_hash == content_hash))
 
     if existing_question:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="question already existed")
     try:
         db_question = QuizData(category = addQuestion.category,
                                    question = addQuestion.question, 
+                                   question_hash = content_hash,
                                    options = (addQuestion.options),
                                      answer = addQuestion.answer)
         db.add(db_question)
-        db.commit()
-        db.refresh(db_question)
+        await db.execute(category_count_upsert(db, {addQuestion.category: 1}))
+        await db.commit()
+        await db.refresh(db_question)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Transaction failed")
+
+    question_index.add(db_question.category, db_question.id)
+    question_cache.put(db_question.id, db_question.answer, db_question.category)
+    category_cache.invalidate()
     
     return {"detail": "Question added successfully", "question_id": db_question.id}
 
+# --------------------------- BULK ADD QUESTIONS ----------------------------------------
+
+class ImportRowError:
+    """ a row of the import body that couldn't be decoded, reported with its reason"""
+
+    __slots__ = ("reason",)
+
+    def __init__(self, reason: str):
+        self.reason = reason
+
+
+def parse_import_body(body: bytes, content_type: str) -> list:
+    """
+    rows of a json array, ndjson or csv body, a row that can't be decoded is
+    returned as an ImportRowError so it shows up in the report
+    """
+    try:
+        text = body.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_CONTENT, detail="Body must be utf-8 encoded")
+
+    if content_type in ("application/x-ndjson", "application/jsonl", "application/ndjson"):
+        rows = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                rows.append(ImportRowError("invalid json"))
+        return rows
+
+    if content_type == "text/csv":
+        rows = []
+        for row in csv.DictReader(io.StringIO(text)):
+            try:
+                row["options"] = json.loads(row.get("options") or "")
+            except ValueError:
+                row = ImportRowError("options must be a json object")
+            rows.append(row)
+        return rows
+
+    try:
+        rows = json.loads(text)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_CONTENT, detail="Body must be a json array")
+    if not isinstance(rows, list):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_CONTENT, detail="Body must be a json array")
+    return rows
+
+
+async def import_questions(db: AsyncSession, rows: list) -> list:
+    """
+    validate, deduplicate and insert questions in batches, returns one result per row.
+    all batches share one transaction so a failure leaves none of the rows behind
+    """
+    results = [None] * len(rows)
+    pending = {}
+
+    for position, row in enumerate(rows):
+        if isinstance(row, ImportRowError):
+            results[position] = {"index": position, "status": "invalid", "reason": row.reason}
+            continue
+        try:
+            question = AddQuestion.model_validate(row)
+        except ValidationError as e:
+            error = e.errors()[0]
+            reason = f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}"
+            results[position] = {"index": position, "status": "invalid", "reason": reason}
+            continue
+        content_hash = question_hash(question.question)
+        if content_hash in pending:
+            results[position] = {"index": position, "status": "skipped", "reason": "duplicate in request"}
+            continue
+        pending[content_hash] = (position, question)
+
+    pending = list(pending.items())
+    inserted = {}
+    for start in range(0, len(pending), IMPORT_BATCH_SIZE):
+        batch = pending[start:start + IMPORT_BATCH_SIZE]
+
+        existing = set((await db.scalars(
+            select(QuizData.question_hash).filter(QuizData.question_hash.in_([content_hash for content_hash, _ in batch])))).all())
+
+        new_rows = [(content_hash, question) for content_hash, (_, question) in batch if content_hash not in existing]
+        if new_rows:
+            statement = (dialect_insert(db, QuizData)
+                         .values([dict(question.model_dump(), question_hash = content_hash) for content_hash, question in new_rows])
+                         .on_conflict_do_nothing()
+                         .returning(QuizData.id, QuizData.question_hash))
+            added_ids = {content_hash: question_id for question_id, content_hash in (await db.execute(statement)).all()}
+            added = Counter(question.category for content_hash, question in new_rows if content_hash in added_ids)
+            if added:
+                await db.execute(category_count_upsert(db, added))
+            inserted.update(added_ids)
+    await db.commit()
+
+    # the in-memory caches only learn about the rows once they are committed
+    for content_hash, (position, question) in pending:
+        question_id = inserted.get(content_hash)
+        if question_id is None:
+            results[position] = {"index": position, "status": "skipped", "reason": "question already existed"}
+        else:
+            results[position] = {"index": position, "status": "inserted", "question_id": question_id}
+            question_index.add(question.category, question_id)
+            question_cache.put(question_id, question.answer, question.category)
+    if inserted:
+        category_cache.invalidate()
+
+    return results
+
+
+@app.post("/add_questions", tags = ["Questions"], status_code=status.HTTP_200_OK)
+@token_required
+async def add_questions(request: Request, db: AsyncSession = Depends(get_async_db), current_user_id: int = None):
+    """
+    bulk import of questions from a json array, ndjson (application/x-ndjson)
+    or csv (text/csv with options as a json column) request body
+    """
+    content_type = request.headers.get("content-type", "application/json").split(";")[0].strip().lower()
+    rows = parse_import_body(await request.body(), content_type)
+
+    if len(rows) > IMPORT_MAX_ROWS:
+        raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+                            detail=f"At most {IMPORT_MAX_ROWS} questions per request")
+
+    try:
+        results = await import_questions(db, rows)
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Bulk import failed: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Transaction failed")
+
+    return {
+        "inserted": sum(1 for result in results if result["status"] == "inserted"),
+        "skipped": sum(1 for result in results if result["status"] == "skipped"),
+        "invalid": sum(1 for result in results if result["status"] == "invalid"),
+        "results": results
+    }
+
 # --------------------------- CATEGORIES LIST ------------------------------
 
 @app.get("/categories", tags = ["Questions"], status_code=status.HTTP_200_OK)
-def category_list(db: Session = Depends(get_db)):
-    category_query = db.query(QuizData.category).distinct().all()
-    if not category_query:
+def category_list(request: Request, response: Response, db: Session = Depends(get_read_db)):
+    body, etag = category_cache.get(db)
+    if body is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="categories are empty")
-    category_list = [category[0] for category in category_query]
 
-    return {"categories": category_list, "category_count": len(category_list)}
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={CATEGORY_MAX_AGE_SECONDS}"}
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    response.headers.update(headers)
+    return body
 
 # -------------------------- DISPLAY QUESTION ----------------------------
 
 
-@app.get("/question",tags = ["Questions"],status_code=status.HTTP_200_OK)
-def display_question(category : str, db:Session = Depends(get_db)):
-    questions_list = db.query(QuizData).filter(QuizData.category == category).order_by(func.random()).first()
+@app.get("/question",tags = ["Questions"],response_model=QuestionOut,status_code=status.HTTP_200_OK)
+def display_question(category : str, db:Session = Depends(get_read_db)):
+    questions_list = question_index.pick(db, category)
     if not questions_list:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Questions not found for the selected category")
     logger.info(f"one question: {questions_list.question}, options: {questions_list.options}")
-    return {"category": questions_list.category, "question": questions_list.question,
-            "options": questions_list.options, "success": True, "id": questions_list.id}
+    # the answer usually follows, keep it from reading the row again
+    question_cache.put(questions_list.id, questions_list.answer, questions_list.category)
+    return fast_response({"category": questions_list.category, "question": questions_list.question,
+                          "options": questions_list.options, "success": True, "id": questions_list.id})
 
 
-# ---------------------------- Choose answer -----------------------------------
-@app.post("/answer", tags = ["Questions"], status_code=status.HTTP_200_OK)
+@app.get("/question/next",tags = ["Questions"],response_model=QuestionOut,status_code=status.HTTP_200_OK)
 @token_required
-async def validate_answer(request: Request, inputAnswer: DisplayAnswerInput,
-                           db: Session = Depends(get_db),
-                             current_user_id : int = None):
-    
-    # Get the question
-    question_entry = db.query(QuizData).filter(QuizData.id == inputAnswer.id).first()
-    if not question_entry:
+async def next_question(request: Request, category: str, mode: SelectionMode = SelectionMode.random,
+                        target: float = Query(ADAPTIVE_TARGET_ACCURACY, gt=0, lt=1),
+                        db: Session = Depends(get_db), current_user_id: int = None):
+    """
+    question of the category the user hasn't attempted yet, uniformly random or with
+    mode=adaptive weighted towards questions the user answers right `target` of the time
+    """
+    def pick():
+        seen = attempted_questions.get(db, current_user_id)
+        if mode == SelectionMode.random:
+            return question_index.pick_unseen(db, category, seen)
+        stats = None
+        if USER_STATS_MATERIALIZED:
+            stats = db.execute(materialized_user_stats_query(current_user_id)).first()
+        if stats is None:
+            stats = db.execute(user_stats_query(current_user_id)).first()
+        accuracy = smoothed_accuracy(stats[0], stats[1], target) if stats else target
+        return adaptive_selector.pick(db, category, accuracy, target, seen)
+
+    question = await asyncio.to_thread(pick)
+    if question is None:
+        if not question_index.has_questions(category):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Questions not found for the selected category")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No unseen questions left in this category")
+    question_cache.put(question.id, question.answer, question.category)
+    return fast_response({"category": question.category, "question": question.question,
+                          "options": question.options, "success": True, "id": question.id})
+
+
+QUESTION_BATCH_MAX = int(os.getenv("QUESTION_BATCH_MAX", "50"))
+
+
+@app.get("/questions",tags = ["Questions"],status_code=status.HTTP_200_OK)
+def display_questions(request: Request, category: str,
+                      count: int = Query(10, ge=1, le=QUESTION_BATCH_MAX),
+                      db: Session = Depends(get_db)):
+    """ a batch of distinct random questions, with a token the user's attempted questions are left out"""
+    user_id = optional_user_id(request)
+    attempted = frozenset()
+    if user_id is not None:
+        attempted = attempted_questions.get(db, user_id)
+
+    questions = question_index.pick_many(db, category, count, attempted)
+    if not questions and not question_index.has_questions(category):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Questions not found for the selected category")
+    for question in questions:
+        question_cache.put(question.id, question.answer, question.category)
+    return {"category": category, "success": True, "count": len(questions),
+            "questions": [{"id": question.id, "question": question.question, "options": question.options}
+                          for question in questions]}
+
+
+# ---------------------------- Choose answer -----------------------------------
+
+# Award money for correct answer
+ANSWER_REWARD = 100
+
+# record attempt, credit wallet and bump balance in one statement, an empty
+# attempt means the unique (user_id, quiz_id) index rejected a second answer
+SUBMIT_ANSWER_SQL = """
+WITH attempt AS (
+    INSERT INTO user_quizes (user_id, quiz_id, status)
+    VALUES (:user_id, :quiz_id, :status)
+    ON CONFLICT (user_id, quiz_id) DO NOTHING
+    RETURNING status
+), wallet AS (
+    INSERT INTO user_wallet (user_id, amount)
+    SELECT CAST(:user_id AS INTEGER), CAST(:amount AS NUMERIC) FROM attempt WHERE status = 1
+    RETURNING id
+), balance AS (
+    UPDATE users SET total_amount = total_amount + :amount, updated_at = now()
+    WHERE id = :user_id AND EXISTS (SELECT 1 FROM attempt WHERE status = 1)
+    RETURNING total_amount
+){stats_cte}
+SELECT (SELECT status FROM attempt) AS status,
+       (SELECT total_amount FROM balance) AS total_amount,
+       {stats_column} AS stats_updated
+"""
+
+SUBMIT_ANSWER_STATS_CTE = """, stats AS (
+    UPDATE user_stats SET total_attempted = total_attempted + 1,
+                          correct_count = correct_count + attempt.status,
+                          wrong_count = wrong_count + 1 - attempt.status,
+                          updated_at = now()
+    FROM attempt WHERE user_stats.user_id = :user_id
+    RETURNING 1
+)"""
+
+SUBMIT_ANSWER = text(SUBMIT_ANSWER_SQL.format(stats_cte="", stats_column="NULL"))
+SUBMIT_ANSWER_WITH_STATS = text(SUBMIT_ANSWER_SQL.format(stats_cte=SUBMIT_ANSWER_STATS_CTE,
+                                                         stats_column="EXISTS (SELECT 1 FROM stats)"))
+
+
+async def submit_answer_sql(db: AsyncSession, user_id: int, inputAnswer: DisplayAnswerInput):
+    """
+    one round trip per answer on PostgreSQL, the answer is checked against the
+    question cache and the statement runs in autocommit mode since a single
+    statement is atomic on its own
+    """
+    question = await question_cache.get(db, inputAnswer.id)
+    if question is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Question not found")
-    
-    # Check if the user already answered this question
-    existing_attempt = db.query(UserQuizes).filter(
-        UserQuizes.user_id == current_user_id,
-        UserQuizes.quiz_id == question_entry.id).first()
-    
-    if existing_attempt:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail = " You have already attempted this question")
-    
-    # Check if answer is correct
-    is_correct = question_entry.answer == inputAnswer.answer
+    correct_answer = question[0]
+    is_correct = correct_answer == inputAnswer.answer
+
+    # a cache miss read the row in a transaction, end it or the autocommit option is ignored
+    # and the statement below runs in that transaction, rolled back when the session closes
+    if db.in_transaction():
+        await db.commit()
+    connection = await db.connection(execution_options={"isolation_level": "AUTOCOMMIT"})
+    statement = SUBMIT_ANSWER_WITH_STATS if USER_STATS_MATERIALIZED else SUBMIT_ANSWER
+    try:
+        row = (await connection.execute(statement, {"quiz_id": inputAnswer.id, "user_id": user_id,
+                                                    "status": int(is_correct), "amount": ANSWER_REWARD})).one()
+    except IntegrityError:
+        # the quiz_id foreign key failed, the question was deleted after it was cached
+        await question_cache.invalidate(inputAnswer.id)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Question not found")
+    except Exception as e:
+        logger.error(f"Answer submission failed: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Transaction failed")
 
-    
+    if row.status is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail = " You have already attempted this question")
 
-    if is_correct:
+    if USER_STATS_MATERIALIZED and not row.stats_updated:
+        # first answer since user_stats is maintained, the upsert counts the history
         try:
-             # Award money for correct answer
-            amount = 100
+            await connection.execute(user_stats_upsert(db, user_id, int(is_correct), int(not is_correct)))
+        except Exception as e:
+            logger.error(f"user_stats upsert failed: {e}")
+
+    return is_correct, correct_answer, row.total_amount
+
+
+async def submit_answer_orm(db: AsyncSession, user_id: int, inputAnswer: DisplayAnswerInput):
+    """ same as submit_answer_sql for databases without data modifying CTEs"""
+
+    # Get the answer, from memory once the question was loaded
+    question = await question_cache.get(db, inputAnswer.id)
+    if question is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Question not found")
+    correct_answer = question[0]
+
+    # Check if answer is correct
+    is_correct = correct_answer == inputAnswer.answer
+
+    # Record the attempt (status 1 correct, 0 wrong), the unique (user_id, quiz_id)
+    # index rejects it if the user already answered this question
+    try:
+        user_quizes = UserQuizes(user_id = user_id, quiz_id = inputAnswer.id, status = int(is_correct))
+        db.add(user_quizes)
+        await db.flush()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail = " You have already attempted this question")
 
+    total_amount = None
+    try:
+        if is_correct:
             # Add wallet entry
-            user_wallet = UserWallet(user_id = current_user_id, amount = amount)
-            db.add(user_wallet)
+            db.add(UserWallet(user_id = user_id, amount = ANSWER_REWARD))
 
             # Update users total amount
-            user_data = db.query(Users).filter(Users.id == current_user_id).first()
+            total_amount = await db.scalar(update(Users)
+                                           .filter(Users.id == user_id)
+                                           .values(total_amount = Users.total_amount + ANSWER_REWARD)
+                                           .returning(Users.total_amount))
 
-            if not user_data:
-                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User not found")
-            user_data.total_amount = user_data.total_amount + amount
+        if USER_STATS_MATERIALIZED:
+            await db.execute(user_stats_upsert(db, user_id, int(is_correct), int(not is_correct)))
 
-            # Record quiz amount as correct
-            user_quizes = UserQuizes(user_id = current_user_id, quiz_id = question_entry.id, status = 1)
-            db.add(user_quizes)
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Transaction failed")
 
-            # Update question stats
-            question_entry.correct_guess_count = question_entry.correct_guess_count + 1
+    return is_correct, correct_answer, total_amount
 
-            question_entry.views += 1
 
-            db.commit()
-        except Exception as e:
-            db.rollback()
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Transaction failed")
+@app.post("/answer", tags = ["Questions"], response_model=AnswerOut, response_model_exclude_none=True,
+          status_code=status.HTTP_200_OK)
+@token_required
+async def validate_answer(request: Request, inputAnswer: DisplayAnswerInput,
+                           db: AsyncSession = Depends(get_async_db),
+                             current_user_id : int = None):
 
-       
+    try:
+        if db.bind.dialect.name == "postgresql":
+            is_correct, correct_answer, total_amount = await submit_answer_sql(db, current_user_id, inputAnswer)
+        else:
+            is_correct, correct_answer, total_amount = await submit_answer_orm(db, current_user_id, inputAnswer)
+    except HTTPException as error:
+        if error.status_code == status.HTTP_400_BAD_REQUEST:
+            attempted_questions.add(current_user_id, inputAnswer.id)
+        raise
+    attempted_questions.add(current_user_id, inputAnswer.id)
+
+    # Update question stats, written to quiz_data in the background
+    question_counters.record(inputAnswer.id, correct = is_correct)
+    adaptive_selector.record(inputAnswer.id, is_correct)
+
+    if is_correct:
+        question = question_cache.lookup(inputAnswer.id)
+        leaderboard.credit(current_user_id, question[1] if question else None, total_amount)
 
-        return{
+    if is_correct:
+        return fast_response({
             "correct": True,
             "message": "Correct answer! you earned 100.",
-            "amount_earned": amount,
-            "total_balance": user_data.total_amount
-        }
-    else:
-        # Record wrong answer (status = 0 for wrong)
-        try:
-            user_quizes = UserQuizes(user_id = current_user_id, quiz_id = question_entry.id, status = 0)
-            db.add(user_quizes)
+            "amount_earned": ANSWER_REWARD,
+            "total_balance": total_amount
+        })
+    return fast_response({
+        "correct": False,
+        "message": "Wrong answer! Better luck next time.",
+        "correct_answer": correct_answer
+    })
 
-            # Update question stats
-            question_entry.wrong_guess_count = question_entry.wrong_guess_count + 1
 
-            question_entry.views += 1
 
-            db.commit()
-        except Exception as e:
-            db.rollback()
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Transaction failed")
-        
-
-        return {
-            "correct": False,
-            "message": "Wrong answer! Better luck next time.",
-            "correct_answer": question_entry.answer
-        }
-    
+ANSWER_BATCH_MAX = int(os.getenv("ANSWER_BATCH_MAX", "50"))
+
+
+async def submit_answers(db: AsyncSession, user_id: int, answers: List[DisplayAnswerInput]):
+    """
+    a round of answers in one transaction: one IN read for the answers, one insert
+    of the attempts (ON CONFLICT DO NOTHING keeps the one attempt per question
+    rule), one wallet insert and one balance update, returns per answer results
+    """
+    questions = await question_cache.get_many(db, list({answer.id for answer in answers}))
+
+    results, attempts, seen = [], [], set()
+    for answer in answers:
+        question = questions.get(answer.id)
+        if question is None:
+            results.append({"id": answer.id, "status_code": status.HTTP_404_NOT_FOUND, "detail": "Question not found"})
+        elif answer.id in seen:
+            results.append({"id": answer.id, "status_code": status.HTTP_400_BAD_REQUEST,
+                            "detail": " You have already attempted this question"})
+        else:
+            seen.add(answer.id)
+            is_correct = question[0] == answer.answer
+            results.append({"id": answer.id, "correct": is_correct})
+            attempts.append({"user_id": user_id, "quiz_id": answer.id, "status": int(is_correct)})
+
+    try:
+        recorded = set()
+        if attempts:
+            statement = (dialect_insert(db, UserQuizes).values(attempts)
+                         .on_conflict_do_nothing(index_elements=[UserQuizes.user_id, UserQuizes.quiz_id])
+                         .returning(UserQuizes.quiz_id))
+            recorded = set((await db.scalars(statement)).all())
+
+        correct_ids = [attempt["quiz_id"] for attempt in attempts if attempt["status"] == 1 and attempt["quiz_id"] in recorded]
+        if correct_ids:
+            await db.execute(insert(UserWallet), [{"user_id": user_id, "amount": ANSWER_REWARD} for _ in correct_ids])
+            total_amount = await db.scalar(update(Users)
+                                           .filter(Users.id == user_id)
+                                           .values(total_amount = Users.total_amount + ANSWER_REWARD * len(correct_ids))
+                                           .returning(Users.total_amount))
+        else:
+            total_amount = await db.scalar(select(Users.total_amount).filter(Users.id == user_id))
+
+        if USER_STATS_MATERIALIZED and recorded:
+            await db.execute(user_stats_upsert(db, user_id, len(correct_ids), len(recorded) - len(correct_ids)))
+
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Answer batch failed: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Transaction failed")
+
+    for result in results:
+        if "correct" not in result:
+            continue
+        if result["id"] not in recorded:
+            # answered in an earlier request
+            result.pop("correct")
+            result.update({"status_code": status.HTTP_400_BAD_REQUEST, "detail": " You have already attempted this question"})
+        elif result["correct"]:
+            result["amount_earned"] = ANSWER_REWARD
+        else:
+            result["correct_answer"] = questions[result["id"]][0]
+    return results, questions, len(correct_ids), total_amount
+
+
+@app.post("/answers", tags = ["Questions"], status_code=status.HTTP_200_OK)
+@token_required
+async def validate_answers(request: Request, inputAnswers: List[DisplayAnswerInput],
+                           db: AsyncSession = Depends(get_async_db),
+                           current_user_id : int = None):
+    """ answers of a whole round, same rules as /answer per item, one transaction for all of them"""
+    if not inputAnswers:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_CONTENT, detail="No answers given")
+    if len(inputAnswers) > ANSWER_BATCH_MAX:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+                            detail=f"At most {ANSWER_BATCH_MAX} answers per request")
+
+    results, questions, correct_count, total_amount = await submit_answers(db, current_user_id, inputAnswers)
+
+    for result in results:
+        if result.get("status_code") == status.HTTP_404_NOT_FOUND:
+            continue
+        attempted_questions.add(current_user_id, result["id"])
+        if "correct" in result:
+            question_counters.record(result["id"], correct = result["correct"])
+            adaptive_selector.record(result["id"], result["correct"])
+            if result["correct"]:
+                leaderboard.credit(current_user_id, questions[result["id"]][1], None)
+    if correct_count:
+        leaderboard.credit(current_user_id, None, total_amount)
+
+    return {
+        "results": results,
+        "correct_count": correct_count,
+        "amount_earned": ANSWER_REWARD * correct_count,
+        "total_balance": total_amount,
+    }
+
+
+
+# -------------------------- LEADERBOARD ----------------------------------
+
+@app.get("/leaderboard", tags = ["Questions"], status_code=status.HTTP_200_OK)
+def get_leaderboard(request: Request, category: Optional[str] = None,
+                    limit: int = Query(10, ge=1, le=LEADERBOARD_MAX_LIMIT),
+                    db: Session = Depends(get_db)):
+    """ top users by balance, or by amount earned in a category, with the caller's rank when a token is sent"""
+    user_id = optional_user_id(request)
+    leaderboard.ensure_loaded()
+    top, total_users, me = leaderboard.board(category, limit, user_id)
+
+    names = dict(db.execute(select(Users.id, Users.name).filter(Users.id.in_([entry[0] for entry in top]))).all()) if top else {}
+    response = {
+        "category": category,
+        "total_users": total_users,
+        "top": [{"rank": position, "user_id": entry_user_id, "name": names.get(entry_user_id), "score": score}
+                for position, (entry_user_id, score) in enumerate(top, 1)],
+    }
+    if me is not None:
+        response["me"] = {"rank": me[0], "score": me[1]}
+    return response
+
+
+
+# -------------------------- HISTORY ----------------------------------
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+HISTORY_DEFAULT_DAYS = 30
+HISTORY_MAX_DAYS = 366
+
+
+def history_range(start: Optional[datetime], end: Optional[datetime]):
+    """
+    bounded UTC time range, on the monthly partitioned user_wallet the planner
+    only scans the partitions the range overlaps
+    """
+    def utc(value):
+        return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+    end = utc(end) if end is not None else datetime.now(timezone.utc)
+    start = utc(start) if start is not None else end - timedelta(days=HISTORY_DEFAULT_DAYS)
+    if start >= end:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_CONTENT, detail="start must be before end")
+    if end - start > timedelta(days=HISTORY_MAX_DAYS):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+                            detail=f"time range is limited to {HISTORY_MAX_DAYS} days")
+    return start, end
+
+
+async def history_page(db: AsyncSession, response: Response, model, columns, user_id: int,
+                       start: Optional[datetime], end: Optional[datetime], cursor: int, limit: int):
+    """ newest first, keyset paginated on id like /users"""
+    start, end = history_range(start, end)
+    statement = (select(*columns)
+                 .filter(model.user_id == user_id, model.timestamp >= start, model.timestamp < end)
+                 .order_by(model.id.desc())
+                 .limit(limit))
+    if cursor:
+        statement = statement.filter(model.id < cursor)
+    rows = [dict(row) for row in (await db.execute(statement)).mappings()]
+
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = str(rows[-1]["id"])
+    return rows
+
+
+@app.get("/history/wallet", tags = ["History"], status_code=status.HTTP_200_OK)
+@token_required
+async def wallet_history(request: Request, response: Response,
+                         start: Optional[datetime] = None, end: Optional[datetime] = None,
+                         cursor: int = Query(0, ge=0, description="id of the last entry of the previous page"),
+                         limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+                         db: AsyncSession = Depends(get_async_db), current_user_id: int = None):
+    """ wallet credits of the user in [start, end), the last HISTORY_DEFAULT_DAYS days by default"""
+    return await history_page(db, response, UserWallet, (UserWallet.id, UserWallet.amount, UserWallet.timestamp),
+                              current_user_id, start, end, cursor, limit)
+
+
+@app.get("/history/answers", tags = ["History"], status_code=status.HTTP_200_OK)
+@token_required
+async def answer_history(request: Request, response: Response,
+                         start: Optional[datetime] = None, end: Optional[datetime] = None,
+                         cursor: int = Query(0, ge=0, description="id of the last attempt of the previous page"),
+                         limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+                         db: AsyncSession = Depends(get_async_db), current_user_id: int = None):
+    """ attempts of the user in [start, end), status 1 is correct"""
+    return await history_page(db, response, UserQuizes,
+                              (UserQuizes.id, UserQuizes.quiz_id, UserQuizes.status, UserQuizes.timestamp),
+                              current_user_id, start, end, cursor, limit)
+
 
 
 # -------------------------- USER STATS ----------------------------------
 
-@app.get('/user_stats',tags = ["Questions"], status_code=status.HTTP_200_OK)
+@app.get('/user_stats',tags = ["Questions"], response_model=UserStatsOut, status_code=status.HTTP_200_OK)
 @token_required
-async def user_quizes(request: Request, db : Session = Depends(get_db), current_user_id : int = None):
+async def user_quizes(request: Request, db : AsyncSession = Depends(get_async_read_db), current_user_id : int = None):
 
-    # Get all user's quiz attemts
-    user_quizes_attempted = db.query(UserQuizes).filter(UserQuizes.user_id == current_user_id).all()
+    # Get the counts and the balance in one row
+    stats = None
+    if USER_STATS_MATERIALIZED:
+        stats = (await db.execute(materialized_user_stats_query(current_user_id))).first()
+    if stats is None:
+        stats = (await db.execute(user_stats_query(current_user_id))).first()
 
-    if not user_quizes_attempted:
+    if not stats or not stats[0]:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not yet started")
 
-    # calculate stats
-    total_attempted = len(user_quizes_attempted)
-    correct_count = len([q for q in user_quizes_attempted if q.status == 1])
-    wrong_count = len([q for q in user_quizes_attempted if q.status == 0])
-
-    # get user's total balance
-    user_balance = db.query(Users).filter(Users.id == current_user_id).first()
+    total_attempted, correct_count, wrong_count, total_amount = stats
 
-    return {
+    return fast_response({
         "success": True,
         "total_attempted": total_attempted,
         "correct_count": correct_count,
         "wrong_count": wrong_count,
         "accuracy_percentage": round(correct_count/total_attempted *100, 2) if total_attempted > 0 else 0,
-        "total_earnings": user_balance.total_amount if user_balance else 0
-    }
+        "total_earnings": total_amount if total_amount is not None else 0
+    })
 
 
-    
 
-    
+# --------------------------- EXPORT ----------------------------------
 
+EXPORT_MEDIA_TYPES = {ExportFormat.ndjson: "application/x-ndjson", ExportFormat.csv: "text/csv"}
 
 
+def export_value(value):
+    """ json/csv friendly value of a column"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
 
-    
-    
 
+def encode_export_rows(rows, columns, export_format: ExportFormat) -> str:
+    if export_format == ExportFormat.ndjson:
+        return "".join(json.dumps({column: export_value(value) for column, value in zip(columns, row)}) + "\n"
+                       for row in rows)
 
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([json.dumps(value) if isinstance(value, (dict, list)) else export_value(value) for value in row])
+    return buffer.getvalue()
 
 
+async def export_rows(bind, statement, export_format: ExportFormat):
+    """
+    yield the encoded rows of the statement batch by batch from a server side
+    cursor, it opens its own session because the request session is closed
+    before the response body is streamed
+    """
+    columns = [column.name for column in statement.selected_columns]
+    if export_format == ExportFormat.csv:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(columns)
+        yield buffer.getvalue()
 
+    async with AsyncSession(bind) as db:
+        result = await db.stream(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for rows in result.partitions():
+            yield encode_export_rows(rows, columns, export_format)
 
 
+def export_response(bind, statement, export_format: ExportFormat, name: str) -> StreamingResponse:
+    headers = {}
+    if export_format == ExportFormat.csv:
+        headers["Content-Disposition"] = f'attachment; filename="{name}.csv"'
+    return StreamingResponse(export_rows(bind, statement, export_format),
+                             media_type=EXPORT_MEDIA_TYPES[export_format], headers=headers)
 
 
+@app.get("/export/quiz_data", tags = ["Export"], status_code=status.HTTP_200_OK)
+@token_required
+async def export_quiz_data(request: Request, format: ExportFormat = ExportFormat.ndjson,
+                           category: Optional[str] = None, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                           db: AsyncSession = Depends(get_async_db), current_user_id: int = None):
+    await require_admin(db, current_user_id)
+
+    statement = select(*QuizData.__table__.columns).order_by(QuizData.id)
+    if category is not None:
+        statement = statement.filter(QuizData.category == category)
+    if start is not None:
+        statement = statement.filter(QuizData.created_at >= start)
+    if end is not None:
+        statement = statement.filter(QuizData.created_at < end)
+
+    return export_response(db.bind, statement, format, "quiz_data")
+
+
+@app.get("/export/user_quizes", tags = ["Export"], status_code=status.HTTP_200_OK)
+@token_required
+async def export_user_quizes(request: Request, format: ExportFormat = ExportFormat.ndjson,
+                             category: Optional[str] = None, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                             db: AsyncSession = Depends(get_async_db), current_user_id: int = None):
+    await require_admin(db, current_user_id)
+
+    statement = select(*UserQuizes.__table__.columns).order_by(UserQuizes.id)
+    if category is not None:
+        statement = statement.join(QuizData, QuizData.id == UserQuizes.quiz_id).filter(QuizData.category == category)
+    if start is not None:
+        statement = statement.filter(UserQuizes.timestamp >= start)
+    if end is not None:
+        statement = statement.filter(UserQuizes.timestamp < end)
+
+    return export_response(db.bind, statement, format, "user_quizes")
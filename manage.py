@@ -0,0 +1,382 @@
+"""
+Database maintenance commands.
+
+    python manage.py migrate
+    python manage.py partition_wallet
+    python manage.py create_partitions --months-ahead 3
+    python manage.py archive_wallet --before 2025-01 --archive-dir archive
+
+migrate is idempotent: it creates missing tables (the app doesn't create them
+on startup), adds new nullable columns and indexes declared on the models to
+existing tables, backfills quiz_data.question_hash and recounts quiz_categories.
+
+partition_wallet (PostgreSQL only, run once) turns user_wallet into a table
+partitioned by month on timestamp, the existing rows become its first
+partition without being copied. create_partitions adds the coming months and
+has to run before a month starts (cron it monthly), archive_wallet writes
+every partition that ends before --before to a gzipped csv and drops it. The
+history from before partition_wallet stays in one legacy partition, archive_wallet
+copies and deletes its months one by one (VACUUM it afterwards to free the space)
+and drops it once it's empty, until then queries can't prune it.
+"""
+
+import argparse
+import gzip
+import os
+import re
+from datetime import date
+
+from sqlalchemy import inspect, select, text, update, bindparam, func
+from sqlalchemy.orm import Session
+
+from main import Base, QuizData, QuizCategory, UserQuizes, engines, logger, question_hash, category_count_upsert
+
+
+BACKFILL_BATCH_SIZE = 1000
+PARTITION_MONTHS_AHEAD = 3
+
+
+
+# ------------------------- SCHEMA ----------------------------
+
+def add_missing_columns(connection):
+    """ ALTER TABLE ... ADD COLUMN for model columns the database doesn't have yet"""
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable:
+                raise RuntimeError(f"{table.name}.{column.name} is NOT NULL and has to be added by hand")
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            logger.info(f"added column {table.name}.{column.name}")
+
+
+def check_duplicate_attempts(connection):
+    """ the unique (user_id, quiz_id) index can't be built while duplicate attempts exist"""
+    duplicates = connection.execute(select(UserQuizes.user_id, UserQuizes.quiz_id, func.count(UserQuizes.id))
+                                    .group_by(UserQuizes.user_id, UserQuizes.quiz_id)
+                                    .having(func.count(UserQuizes.id) > 1)).all()
+    if duplicates:
+        raise RuntimeError(f"user_quizes has duplicate (user_id, quiz_id, count) attempts, "
+                           f"resolve them before migrating: {[tuple(row) for row in duplicates]}")
+
+
+def create_missing_indexes(connection):
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.name == "ux_user_quizes_user_id_quiz_id":
+                check_duplicate_attempts(connection)
+            index.create(connection)
+            logger.info(f"created index {index.name}")
+
+
+def drop_legacy_constraints(connection):
+    # duplicates are detected through question_hash, the unique index on the full text is not needed
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("ALTER TABLE quiz_data DROP CONSTRAINT IF EXISTS quiz_data_question_key"))
+
+
+
+# ------------------------- BACKFILL ----------------------------
+
+def backfill_question_hashes(db: Session, batch_size: int = BACKFILL_BATCH_SIZE):
+    """
+    set question_hash on rows that don't have one, a row whose normalized text
+    matches an earlier question keeps a NULL hash and is returned for review
+    """
+    used = set(db.scalars(select(QuizData.question_hash).filter(QuizData.question_hash.is_not(None))).all())
+    table = QuizData.__table__
+    statement = update(table).where(table.c.id == bindparam("question_id")).values(question_hash=bindparam("content_hash"))
+
+    updated, duplicates, last_id = 0, [], 0
+    while True:
+        rows = db.execute(select(QuizData.id, QuizData.question)
+                          .filter(QuizData.question_hash.is_(None), QuizData.id > last_id)
+                          .order_by(QuizData.id)
+                          .limit(batch_size)).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        params = []
+        for question_id, question in rows:
+            content_hash = question_hash(question)
+            if content_hash in used:
+                duplicates.append(question_id)
+                continue
+            used.add(content_hash)
+            params.append({"question_id": question_id, "content_hash": content_hash})
+
+        if params:
+            db.execute(statement, params)
+        db.commit()
+        updated += len(params)
+
+    return updated, duplicates
+
+
+def refresh_category_counts(db: Session):
+    """ rebuild quiz_categories from quiz_data"""
+    counts = dict(db.query(QuizData.category, func.count(QuizData.id)).group_by(QuizData.category).all())
+    db.query(QuizCategory).delete()
+    if counts:
+        db.execute(category_count_upsert(db, counts))
+    db.commit()
+    return counts
+
+
+
+# ------------------------- PARTITIONS ----------------------------
+
+WALLET_TABLE = "user_wallet"
+WALLET_LEGACY_PARTITION = "user_wallet_legacy"
+WALLET_PARTITION_PATTERN = re.compile(r"^user_wallet_y(\d{4})m(\d{2})$")
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_partition_name(month: date) -> str:
+    return f"{WALLET_TABLE}_y{month.year}m{month.month:02d}"
+
+
+def utc_literal(month: date) -> str:
+    # partition bounds are UTC midnights, like the ranges of the history endpoints
+    return f"'{month} 00:00:00+00'"
+
+
+def require_postgresql(connection):
+    if connection.dialect.name != "postgresql":
+        raise RuntimeError("partitioning needs PostgreSQL")
+
+
+def is_partitioned(connection) -> bool:
+    return connection.execute(text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p JOIN pg_class c "
+                                   "ON c.oid = p.partrelid WHERE c.relname = :name)"), {"name": WALLET_TABLE}).scalar()
+
+
+def create_wallet_partitions(connection, months_ahead: int = PARTITION_MONTHS_AHEAD, today: date = None):
+    """ monthly partitions from the current month to months_ahead months from now"""
+    require_postgresql(connection)
+    if not is_partitioned(connection):
+        raise RuntimeError(f"{WALLET_TABLE} is not partitioned, run partition_wallet first")
+    current = (today or date.today()).replace(day=1)
+    first_month = partitioned_from(connection)
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        name = month_partition_name(month)
+        exists = connection.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}).scalar()
+        if exists or month < first_month:
+            continue
+        connection.execute(text(f"CREATE TABLE {name} PARTITION OF {WALLET_TABLE} "
+                                f"FOR VALUES FROM ({utc_literal(month)}) TO ({utc_literal(add_months(month, 1))})"))
+        created.append(name)
+        logger.info(f"created partition {name}")
+    return created
+
+
+def partitioned_from(connection) -> date:
+    """ first month that isn't covered by the legacy partition"""
+    bound = connection.execute(text("SELECT pg_get_expr(c.relpartbound, c.oid) FROM pg_class c WHERE c.relname = :name"),
+                               {"name": WALLET_LEGACY_PARTITION}).scalar()
+    if bound is None:
+        return date.min
+    # FOR VALUES FROM (MINVALUE) TO ('2026-11-01 00:00:00+00')
+    return date.fromisoformat(re.search(r"TO \('(\d{4}-\d{2}-\d{2})", bound).group(1))
+
+
+def partition_user_wallet(connection, months_ahead: int = PARTITION_MONTHS_AHEAD, today: date = None):
+    """
+    swap user_wallet for a partitioned table, the old table is attached as the
+    partition of everything before next month so no row is copied, it still
+    scans the table and builds the (id, timestamp) primary key under an exclusive
+    lock, so run it in a maintenance window
+    """
+    require_postgresql(connection)
+    if is_partitioned(connection):
+        logger.info(f"{WALLET_TABLE} is already partitioned")
+        return create_wallet_partitions(connection, months_ahead, today)
+
+    boundary = add_months((today or date.today()).replace(day=1), 1)
+    legacy = WALLET_LEGACY_PARTITION
+    connection.execute(text(f'UPDATE {WALLET_TABLE} SET "timestamp" = now() WHERE "timestamp" IS NULL'))
+    connection.execute(text(f"ALTER TABLE {WALLET_TABLE} RENAME TO {legacy}"))
+    connection.execute(text(f"ALTER INDEX ix_user_wallet_user_id_timestamp RENAME TO {legacy}_user_id_timestamp_idx"))
+    # the partition key has to be part of the primary key
+    connection.execute(text(f"ALTER TABLE {legacy} DROP CONSTRAINT user_wallet_pkey"))
+    connection.execute(text(f'ALTER TABLE {legacy} ALTER COLUMN "timestamp" SET NOT NULL'))
+    connection.execute(text(f'ALTER TABLE {legacy} ADD PRIMARY KEY (id, "timestamp")'))
+
+    connection.execute(text(f"""
+        CREATE TABLE {WALLET_TABLE} (
+            id INTEGER NOT NULL DEFAULT nextval('user_wallet_id_seq'),
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            amount NUMERIC(10, 2) NOT NULL,
+            "timestamp" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            PRIMARY KEY (id, "timestamp")
+        ) PARTITION BY RANGE ("timestamp")
+    """))
+    connection.execute(text(f"ALTER SEQUENCE user_wallet_id_seq OWNED BY {WALLET_TABLE}.id"))
+    connection.execute(text(f"ALTER TABLE {WALLET_TABLE} ATTACH PARTITION {legacy} "
+                            f"FOR VALUES FROM (MINVALUE) TO ({utc_literal(boundary)})"))
+    # attaches the legacy table's matching index instead of building a new one
+    connection.execute(text(f'CREATE INDEX ix_user_wallet_user_id_timestamp ON {WALLET_TABLE} (user_id, "timestamp")'))
+    logger.info(f"{WALLET_TABLE} partitioned by month, rows before {boundary} are in {legacy}")
+    return create_wallet_partitions(connection, months_ahead, today)
+
+
+def wallet_partitions(connection):
+    """ (name, first month) of the monthly partitions, oldest first"""
+    names = connection.execute(text("SELECT c.relname FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhparent "
+                                    "JOIN pg_class c ON c.oid = i.inhrelid WHERE p.relname = :name"),
+                               {"name": WALLET_TABLE}).scalars().all()
+    months = []
+    for name in names:
+        match = WALLET_PARTITION_PATTERN.match(name)
+        if match:
+            months.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(months, key=lambda partition: partition[1])
+
+
+def copy_to_archive(connection, source: str, path: str, expected: int):
+    """ COPY a table or a (query) to a gzipped csv and check the file has `expected` rows"""
+    cursor = connection.connection.cursor()
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as archive:
+        cursor.copy_expert(f"COPY {source} TO STDOUT WITH (FORMAT csv, HEADER)", archive)
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        written = sum(1 for _ in archive) - 1
+    if written != expected:
+        raise RuntimeError(f"{path} has {written} rows, {source} has {expected}, nothing was removed")
+
+
+def archive_legacy_months(connection, before: date, directory: str):
+    """
+    the legacy partition holds all history from before partition_wallet, its months
+    that end on or before `before` are copied to <directory>/user_wallet_yYYYYmMM.csv.gz
+    like the monthly partitions and deleted from it, once the archived months cover
+    its whole range and it's empty it is detached and dropped. deleted rows only
+    give their space back after a VACUUM, and queries can't prune the legacy
+    partition while it exists
+    """
+    exists = connection.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": WALLET_LEGACY_PARTITION}).scalar()
+    if not exists:
+        return []
+    legacy = WALLET_LEGACY_PARTITION
+    boundary = partitioned_from(connection)
+    oldest = connection.execute(text(f"""SELECT min("timestamp") AT TIME ZONE 'UTC' FROM {legacy}""")).scalar()
+    archived = []
+    month = date(oldest.year, oldest.month, 1) if oldest is not None else boundary
+    while add_months(month, 1) <= min(before, boundary):
+        next_month = add_months(month, 1)
+        in_month = f'"timestamp" >= {utc_literal(month)} AND "timestamp" < {utc_literal(next_month)}'
+        expected = connection.execute(text(f"SELECT count(*) FROM {legacy} WHERE {in_month}")).scalar()
+        if expected:
+            path = os.path.join(directory, f"{month_partition_name(month)}.csv.gz")
+            copy_to_archive(connection, f"(SELECT * FROM {legacy} WHERE {in_month} ORDER BY id)", path, expected)
+            connection.execute(text(f"DELETE FROM {legacy} WHERE {in_month}"))
+            archived.append(path)
+            logger.info(f"archived {expected} rows of {legacy} to {path}")
+        month = next_month
+
+    empty = connection.execute(text(f"SELECT NOT EXISTS (SELECT 1 FROM {legacy})")).scalar()
+    if before >= boundary and empty:
+        connection.execute(text(f"ALTER TABLE {WALLET_TABLE} DETACH PARTITION {legacy}"))
+        connection.execute(text(f"DROP TABLE {legacy}"))
+        logger.info(f"{legacy} is fully archived and was dropped")
+    return archived
+
+
+def archive_wallet_partitions(connection, before: date, directory: str):
+    """
+    archive the months of the legacy partition that end on or before `before`
+    (see archive_legacy_months), then COPY each monthly partition that ends on or
+    before `before` to <directory>/<partition>.csv.gz and detach and drop it, the
+    row count of every file is checked before anything is removed
+    """
+    require_postgresql(connection)
+    os.makedirs(directory, exist_ok=True)
+    archived = archive_legacy_months(connection, before, directory)
+    for name, month in wallet_partitions(connection):
+        if add_months(month, 1) > before:
+            continue
+        path = os.path.join(directory, f"{name}.csv.gz")
+        expected = connection.execute(text(f"SELECT count(*) FROM {name}")).scalar()
+        copy_to_archive(connection, name, path, expected)
+
+        connection.execute(text(f"ALTER TABLE {WALLET_TABLE} DETACH PARTITION {name}"))
+        connection.execute(text(f"DROP TABLE {name}"))
+        archived.append(path)
+        logger.info(f"archived {expected} rows of {name} to {path}")
+    return archived
+
+
+
+# ------------------------- COMMANDS ----------------------------
+
+def migrate(args):
+    """ run before the first start and after every upgrade"""
+    engine = engines.engine
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        add_missing_columns(connection)
+
+    with Session(engine) as db:
+        updated, duplicates = backfill_question_hashes(db, args.batch_size)
+        counts = refresh_category_counts(db)
+    logger.info(f"question_hash set on {updated} questions")
+    if duplicates:
+        logger.warning(f"{len(duplicates)} questions duplicate an earlier one and were left without a hash: {duplicates}")
+    logger.info(f"quiz_categories recounted, {len(counts)} categories")
+
+    with engine.begin() as connection:
+        create_missing_indexes(connection)
+        drop_legacy_constraints(connection)
+
+
+def partition_wallet(args):
+    with engines.engine.begin() as connection:
+        partition_user_wallet(connection, args.months_ahead)
+
+
+def create_partitions(args):
+    with engines.engine.begin() as connection:
+        create_wallet_partitions(connection, args.months_ahead)
+
+
+def archive_wallet(args):
+    if args.before is None:
+        raise SystemExit("archive_wallet needs --before YYYY-MM")
+    before = date.fromisoformat(f"{args.before}-01")
+    with engines.engine.begin() as connection:
+        archive_wallet_partitions(connection, before, args.archive_dir)
+
+
+COMMANDS = {
+    "migrate": migrate,
+    "partition_wallet": partition_wallet,
+    "create_partitions": create_partitions,
+    "archive_wallet": archive_wallet,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE)
+    parser.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    parser.add_argument("--before", help="archive partitions of months before this one, YYYY-MM")
+    parser.add_argument("--archive-dir", default="archive")
+    args = parser.parse_args()
+    COMMANDS[args.command](args)